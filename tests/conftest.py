@@ -0,0 +1,15 @@
+# tests/conftest.py
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+# The tests import the utils modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the label and image size caches of the test datasets out of the user cache (read at import, and by the workers)
+_CACHE_DIR = tempfile.mkdtemp(prefix='yolo-parking-spot-tests-')
+os.environ['YOLO_PARKING_SPOT_CACHE'] = _CACHE_DIR
+atexit.register(shutil.rmtree, _CACHE_DIR, True)
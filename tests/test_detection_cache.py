@@ -0,0 +1,126 @@
+# tests/test_detection_cache.py
+
+import numpy as np
+import pytest
+
+from utils.detection_cache import DetectionCache, CachedDetector, detector_key
+
+
+## Helpers ##
+
+# Detector with the settings of Detector (weights file, conf, iou, ...), counting the images it runs
+class FakeDetector:
+    def __init__(self, model_path: str, conf: float = 0.25):
+        self.model = 'fake'
+        self.model_path = model_path
+        self.conf = conf
+        self.iou = 0.45
+        self.batch_size = 4
+        self.car_classes = [0]
+        self.predicted = 0
+
+    def predict(self, images):
+        self.predicted += len(images)
+        return [np.array([[0, image.mean() / 255, 0.5, 0.1, 0.1]]) for image in images]
+
+@pytest.fixture
+def weights(tmp_path):
+    path = tmp_path / 'model.pt'
+    path.write_bytes(b'weights v1')
+    return str(path)
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DetectionCache(str(tmp_path / 'cache' / 'detections.sqlite'))
+    yield cache
+    cache.close()
+
+IMAGES = [np.full((32, 32, 3), value, dtype=np.uint8) for value in (10, 20, 30)]
+
+# Function to get (K,5) car labels of a given number of cars
+def cars(count: int):
+    return np.column_stack([np.zeros(count), np.random.default_rng(count).random((count, 4))])
+
+
+## Tests ##
+
+def test_hit_skips_the_detector(cache, weights):
+    detector = FakeDetector(weights)
+    cached_detector = CachedDetector(detector, cache)
+
+    first = cached_detector.predict(IMAGES)
+    assert detector.predicted == 3 and cache.misses == 3
+
+    second = cached_detector.predict(IMAGES)
+    assert detector.predicted == 3 and cache.hits == 3
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+def test_only_missing_images_are_detected(cache, weights):
+    detector = FakeDetector(weights)
+    cached_detector = CachedDetector(detector, cache)
+
+    cached_detector.predict(IMAGES[:1])
+    cached_detector.predict(IMAGES)
+    assert detector.predicted == 3
+
+def test_weights_change_misses(cache, weights):
+    detector = FakeDetector(weights)
+    CachedDetector(detector, cache).predict(IMAGES)
+    key = detector_key(detector)
+
+    # Same path, retrained weights
+    with open(weights, 'wb') as f:
+        f.write(b'retrained weights')
+    new_detector = FakeDetector(weights)
+    assert detector_key(new_detector) != key
+
+    CachedDetector(new_detector, cache).predict(IMAGES)
+    assert new_detector.predicted == 3
+
+def test_settings_change_misses(cache, weights):
+    CachedDetector(FakeDetector(weights), cache).predict(IMAGES)
+
+    detector = FakeDetector(weights, conf=0.5)
+    CachedDetector(detector, cache).predict(IMAGES)
+    assert detector.predicted == 3
+
+    # The batch size doesn't change the detections
+    detector = FakeDetector(weights)
+    detector.batch_size = 16
+    CachedDetector(detector, cache).predict(IMAGES)
+    assert detector.predicted == 0
+
+def test_pretrained_name_key():
+    # Pre-trained weights given by name are not a local file
+    assert detector_key(FakeDetector('yolov8n.pt')) == detector_key(FakeDetector('yolov8n.pt'))
+    assert detector_key(FakeDetector('yolov8n.pt')) != detector_key(FakeDetector('yolov8s.pt'))
+
+def test_eviction_at_capacity(tmp_path):
+    # Each entry is its key and 10 cars (320 bytes), two fit
+    cache = DetectionCache(str(tmp_path / 'detections.sqlite'), max_size_mb=700 / 1024 / 1024)
+    cache.put('a', cars(10))
+    cache.put('b', cars(10))
+    assert len(cache) == 2
+
+    # 'a' was used last, 'b' is evicted
+    assert cache.get('a') is not None
+    cache.put('c', cars(10))
+    assert len(cache) == 2 and cache.size <= cache.max_size
+    assert cache.get('b') is None
+    np.testing.assert_array_equal(cache.get('a'), cars(10))
+    np.testing.assert_array_equal(cache.get('c'), cars(10))
+    cache.close()
+
+def test_entries_persist(tmp_path, weights):
+    path = str(tmp_path / 'detections.sqlite')
+    cache = DetectionCache(path)
+    CachedDetector(FakeDetector(weights), cache).predict(IMAGES)
+    size = cache.size
+    cache.close()
+
+    cache = DetectionCache(path)
+    detector = FakeDetector(weights)
+    CachedDetector(detector, cache).predict(IMAGES)
+    assert detector.predicted == 0 and cache.size == size
+    cache.close()
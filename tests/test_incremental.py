@@ -0,0 +1,111 @@
+# tests/test_incremental.py
+
+import os
+import re
+import shutil
+import pytest
+
+from utils.benchmark import make_synthetic_dataset
+from utils.occupancy import process_images, RUN_MANIFEST_FILE
+
+
+## Helpers ##
+
+IMAGE_FILES = [f'lot_{i}.jpg' for i in range(4)]
+
+# Small synthetic dataset (4 images of the same lot), with a copy of the labels as layouts
+@pytest.fixture
+def data_path(tmp_path):
+    data_path = str(tmp_path / 'data')
+    make_synthetic_dataset(data_path, images=len(IMAGE_FILES), spots=24, cars=16, image_width=320, image_height=240, rows=4)
+    shutil.copytree(os.path.join(data_path, 'labels'), os.path.join(data_path, 'layouts'))
+    return data_path
+
+# Function to run process_images incrementally, returns the number of (changed, unchanged, deleted) images it printed
+def run_incremental(capsys, data_path: str, output_folder: str, threshold: float = 0.4, **kwargs):
+    capsys.readouterr()
+    process_images(data_path, output_folder, threshold, workers=1, incremental=True, **kwargs)
+    counts = re.search(r'(\d+) new or changed images, (\d+) unchanged, (\d+) deleted', capsys.readouterr().out)
+    return tuple(int(count) for count in counts.groups())
+
+# Function to check that an incremental output matches the output of a full run on the same data
+def assert_same_as_full_run(data_path: str, output_folder: str, tmp_path, threshold: float = 0.4, **kwargs):
+    full_folder = str(tmp_path / 'full')
+    shutil.rmtree(full_folder, ignore_errors=True)
+    process_images(data_path, full_folder, threshold, workers=1, **kwargs)
+    with open(os.path.join(output_folder, 'output.csv')) as f, open(os.path.join(full_folder, 'output.csv')) as g:
+        assert f.read() == g.read()
+    assert sorted(os.listdir(os.path.join(output_folder, 'images'))) == sorted(os.listdir(os.path.join(full_folder, 'images')))
+
+# Function to touch a label/layout file with new content (removes its first line)
+def edit_file(path: str):
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, 'w') as f:
+        f.writelines(lines[1:])
+
+
+## Tests ##
+
+def test_first_run_processes_every_image(capsys, data_path, tmp_path):
+    output_folder = str(tmp_path / 'out')
+    assert run_incremental(capsys, data_path, output_folder) == (4, 0, 0)
+    assert os.path.isfile(os.path.join(output_folder, RUN_MANIFEST_FILE))
+    assert_same_as_full_run(data_path, output_folder, tmp_path)
+
+def test_unchanged_inputs_are_reused(capsys, data_path, tmp_path):
+    output_folder = str(tmp_path / 'out')
+    run_incremental(capsys, data_path, output_folder)
+    with open(os.path.join(output_folder, 'output.csv')) as f:
+        first_output = f.read()
+
+    assert run_incremental(capsys, data_path, output_folder) == (0, 4, 0)
+    with open(os.path.join(output_folder, 'output.csv')) as f:
+        assert f.read() == first_output
+
+def test_changed_label_reprocesses_its_image(capsys, data_path, tmp_path):
+    output_folder = str(tmp_path / 'out')
+    run_incremental(capsys, data_path, output_folder)
+
+    edit_file(os.path.join(data_path, 'labels', 'lot_2.txt'))
+    assert run_incremental(capsys, data_path, output_folder) == (1, 3, 0)
+    assert_same_as_full_run(data_path, output_folder, tmp_path)
+
+def test_changed_threshold_reprocesses_every_image(capsys, data_path, tmp_path):
+    output_folder = str(tmp_path / 'out')
+    run_incremental(capsys, data_path, output_folder)
+
+    assert run_incremental(capsys, data_path, output_folder, threshold=0.6) == (4, 0, 0)
+    assert_same_as_full_run(data_path, output_folder, tmp_path, threshold=0.6)
+
+def test_changed_layouts_reprocess_the_images(capsys, data_path, tmp_path):
+    output_folder = str(tmp_path / 'out')
+    layouts_folder = os.path.join(data_path, 'layouts')
+    run_incremental(capsys, data_path, output_folder)
+
+    # Other layouts folder: new run settings
+    assert run_incremental(capsys, data_path, output_folder, layouts_folder=layouts_folder) == (4, 0, 0)
+
+    # Changed layout file: only the images of this layout
+    edit_file(os.path.join(layouts_folder, 'lot_1.txt'))
+    assert run_incremental(capsys, data_path, output_folder, layouts_folder=layouts_folder) == (1, 3, 0)
+    assert_same_as_full_run(data_path, output_folder, tmp_path, layouts_folder=layouts_folder)
+
+    # Layout shared by every image (lot.txt) through a layout pattern
+    shutil.copy(os.path.join(layouts_folder, 'lot_0.txt'), os.path.join(layouts_folder, 'lot.txt'))
+    assert run_incremental(capsys, data_path, output_folder, layouts_folder=layouts_folder, layout_pattern='lot') == (4, 0, 0)
+    edit_file(os.path.join(layouts_folder, 'lot.txt'))
+    assert run_incremental(capsys, data_path, output_folder, layouts_folder=layouts_folder, layout_pattern='lot') == (4, 0, 0)
+    assert_same_as_full_run(data_path, output_folder, tmp_path, layouts_folder=layouts_folder, layout_pattern='lot')
+
+def test_deleted_image_is_dropped(capsys, data_path, tmp_path):
+    output_folder = str(tmp_path / 'out')
+    run_incremental(capsys, data_path, output_folder)
+    assert os.path.isfile(os.path.join(output_folder, 'images', 'lot_3.jpg'))
+
+    os.remove(os.path.join(data_path, 'images', 'lot_3.jpg'))
+    assert run_incremental(capsys, data_path, output_folder) == (0, 3, 1)
+    assert not os.path.exists(os.path.join(output_folder, 'images', 'lot_3.jpg'))
+    with open(os.path.join(output_folder, 'output.csv')) as f:
+        assert 'lot_3.jpg' not in f.read()
+    assert_same_as_full_run(data_path, output_folder, tmp_path)
@@ -0,0 +1,226 @@
+# utils/benchmark.py
+
+# Benchmark suite timing the occupancy and reporting hot paths on synthetic parking lots
+
+import numpy as np
+import cv2
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+try:
+    from utils.functions import load_labels, yolo_to_pixel_boxes, compute_occupancy, is_occupied, draw_bounding_boxes, process_images, rotate_image_and_bboxes
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from functions import load_labels, yolo_to_pixel_boxes, compute_occupancy, is_occupied, draw_bounding_boxes, process_images, rotate_image_and_bboxes
+
+
+## Synthetic lots ##
+
+# Function to generate the labels of a synthetic parking lot in YOLO format, as an (N,5) array
+# The spots are placed on a grid of rows x ceil(spots / rows), disabled_ratio of them are disabled spots (class 1)
+# parked_ratio of the cars are parked on a random spot (with some jitter), the others are in transit anywhere in the lot
+def synthetic_lot_labels(spots: int = 200, cars: int = 150, rows: int = 10, disabled_ratio: float = 0.1, parked_ratio: float = 0.8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    columns = -(-spots // rows)
+    cell_width, cell_height = 1 / columns, 1 / rows
+
+    # Spots fill 80% of their grid cell
+    index = np.arange(spots)
+    spot_labels = np.column_stack([
+        np.where(rng.random(spots) < disabled_ratio, 1, 2),
+        (index % columns + 0.5) * cell_width,
+        (index // columns + 0.5) * cell_height,
+        np.full(spots, cell_width * 0.8),
+        np.full(spots, cell_height * 0.8)
+    ])
+
+    # Cars are a bit smaller than the spots
+    parked = min(int(cars * parked_ratio), spots)
+    parked_spots = rng.choice(spots, parked, replace=False)
+    centers = np.concatenate([
+        spot_labels[parked_spots, 1:3] + rng.normal(0, 0.05, (parked, 2)) * [cell_width, cell_height],
+        rng.uniform(0.05, 0.95, (cars - parked, 2))
+    ])
+    car_labels = np.column_stack([
+        np.zeros(cars),
+        centers,
+        np.full(cars, cell_width * 0.6),
+        np.full(cars, cell_height * 0.6)
+    ])
+
+    return np.concatenate([spot_labels, car_labels])
+
+# Function to render a synthetic lot image: gray asphalt with noise, white spot outlines and dark car rectangles
+def synthetic_lot_image(labels, image_width: int = 1920, image_height: int = 1080, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(90, 110, (image_height, image_width, 3), dtype=np.uint8)
+    pixel_boxes = yolo_to_pixel_boxes(labels[:, 1:], image_width, image_height)
+    for class_id, (left, top, right, bottom) in zip(labels[:, 0].tolist(), pixel_boxes.tolist()):
+        if class_id == 0:
+            cv2.rectangle(image, (left, top), (right, bottom), [int(c) for c in rng.integers(0, 255, 3)], -1)
+        else:
+            cv2.rectangle(image, (left, top), (right, bottom), (255, 255, 255) if class_id == 2 else (255, 128, 0), 1)
+    return image
+
+# Function to write a synthetic dataset (images/ and labels/ folders, like data/) of images lots to data_path
+# Each image gets its own seed, so the cars move between images
+def make_synthetic_dataset(data_path: str, images: int = 4, spots: int = 200, cars: int = 150, image_width: int = 1920, image_height: int = 1080, rows: int = 10, seed: int = 0):
+    os.makedirs(os.path.join(data_path, 'images'), exist_ok=True)
+    os.makedirs(os.path.join(data_path, 'labels'), exist_ok=True)
+
+    for i in range(images):
+        labels = synthetic_lot_labels(spots, cars, rows, seed=seed + i)
+        cv2.imwrite(os.path.join(data_path, 'images', f'lot_{i}.jpg'), synthetic_lot_image(labels, image_width, image_height, seed + i))
+        with open(os.path.join(data_path, 'labels', f'lot_{i}.txt'), 'w') as f:
+            f.writelines(f'{int(c)} {cx} {cy} {w} {h}\n' for c, cx, cy, w, h in labels.tolist())
+
+
+## Timing ##
+
+# Function to time a function, returns the min/median/mean time in milliseconds over repeat runs (after warmup runs)
+# Anything the function prints is discarded
+def time_function(function, repeat: int = 5, warmup: int = 1):
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for run in range(warmup + repeat):
+            start = time.perf_counter()
+            function()
+            if run >= warmup:
+                times.append((time.perf_counter() - start) * 1000)
+    return {'min ms': min(times), 'median ms': float(np.median(times)), 'mean ms': float(np.mean(times))}
+
+# Imports timed in a fresh interpreter, from the utils folder like yolov5start.py
+IMPORT_STATEMENTS = {
+    'import dataset prep': 'from functions import split_dataset, data_augmentation, only_car_label, parse_opt',
+    'import occupancy engine': 'from functions import compute_occupancy, LayoutRegistry',
+    'import process_images': 'from functions import process_images',
+    'import reporting': 'from functions import get_results_df, plot_mAP',
+    'import detector': 'from detector import Detector'
+}
+
+# Function to time the cold imports of IMPORT_STATEMENTS, each in a new Python process
+# The interpreter startup (python -c pass) is subtracted from every time
+def time_imports(repeat: int = 5):
+    utils_folder = os.path.dirname(os.path.abspath(__file__))
+
+    def run(statement):
+        subprocess.run([sys.executable, '-c', statement], cwd=utils_folder, check=True)
+
+    startup = time_function(lambda: run('pass'), repeat)['median ms']
+    results = {}
+    for name, statement in IMPORT_STATEMENTS.items():
+        timing = time_function(lambda: run(statement), repeat)
+        results[name] = {measure: value - startup for measure, value in timing.items()}
+    return results
+
+# Function to run every benchmark stage on a synthetic dataset, returns the JSON-serializable report
+def run_benchmarks(images: int = 4, spots: int = 200, cars: int = 150, image_width: int = 1920, image_height: int = 1080, rows: int = 10, repeat: int = 5, threshold: float = 0.4, seed: int = 0, workdir: str = ''):
+    config = {
+        'Images': images, 'Spots': spots, 'Cars': cars, 'Image width': image_width, 'Image height': image_height,
+        'Grid rows': rows, 'Repeat': repeat, 'Threshold': threshold, 'Seed': seed
+    }
+
+    with tempfile.TemporaryDirectory(dir=workdir or None) as temp_folder:
+        data_path = os.path.join(temp_folder, 'data')
+        output_folder = os.path.join(temp_folder, 'output')
+        make_synthetic_dataset(data_path, images, spots, cars, image_width, image_height, rows, seed)
+
+        image_path = os.path.join(data_path, 'images', 'lot_0.jpg')
+        label_path = os.path.join(data_path, 'labels', 'lot_0.txt')
+        image = cv2.imread(image_path)
+        labels = load_labels(label_path)
+        pixel_boxes = yolo_to_pixel_boxes(labels[:, 1:], image_width, image_height)
+        spot_boxes = pixel_boxes[labels[:, 0] != 0]
+        car_boxes = pixel_boxes[labels[:, 0] == 0]
+        lines = [f'{int(c)} {cx} {cy} {w} {h}\n' for c, cx, cy, w, h in labels.tolist()]
+        os.makedirs(output_folder, exist_ok=True)
+
+        stages = {
+            # Legacy per-spot API, one call per spot of the image
+            'is_occupied (all spots)': lambda: [is_occupied(image, lines, *box, threshold) for box in spot_boxes.tolist()],
+            'compute_occupancy': lambda: compute_occupancy(spot_boxes, car_boxes, threshold),
+            'draw_bounding_boxes': lambda: draw_bounding_boxes(image_path, label_path, output_folder, threshold, True),
+            'draw_bounding_boxes (render=False)': lambda: draw_bounding_boxes(image_path, label_path, output_folder, threshold, True, render=False),
+            # process_labels was replaced by process_images(render=False)
+            'process_images (render=False)': lambda: process_images(data_path, output_folder, threshold, workers=1, render=False),
+            'process_images': lambda: process_images(data_path, output_folder, threshold, workers=1),
+            'rotate_image_and_bboxes': lambda: rotate_image_and_bboxes(image, labels.tolist(), 30)
+        }
+        results = {name: time_function(function, repeat) for name, function in stages.items()}
+
+    return {
+        'Config': config,
+        'Environment': {
+            'Python': platform.python_version(),
+            'NumPy': np.__version__,
+            'OpenCV': cv2.__version__,
+            'Platform': platform.platform(),
+            'CPUs': os.cpu_count()
+        },
+        'Stages': results,
+        'Imports': time_imports(repeat)
+    }
+
+# Function to compare a report with a baseline report, a stage regressed if its median time
+# is more than tolerance (relative) above the baseline. Returns the regressions {stage: ratio}
+def compare_reports(report, baseline, tolerance: float = 0.2):
+    if report['Config'] != baseline['Config']:
+        print('The baseline was run with a different config, the comparison may not be meaningful ❌')
+
+    regressions = {}
+    for section in ('Stages', 'Imports'):
+        for stage, timing in report.get(section, {}).items():
+            if stage not in baseline.get(section, {}):
+                continue
+            ratio = timing['median ms'] / baseline[section][stage]['median ms']
+            if ratio > 1 + tolerance:
+                regressions[stage] = ratio
+                print(f'{stage}: {ratio:.2f}x the baseline ❌')
+            else:
+                print(f'{stage}: {ratio:.2f}x the baseline ✅')
+    return regressions
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=4, help='number of synthetic images')
+    parser.add_argument('--spots', type=int, default=200, help='parking spots per image')
+    parser.add_argument('--cars', type=int, default=150, help='cars per image')
+    parser.add_argument('--width', type=int, default=1920, help='image width')
+    parser.add_argument('--height', type=int, default=1080, help='image height')
+    parser.add_argument('--rows', type=int, default=10, help='rows of the spot grid')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per stage')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic lots')
+    parser.add_argument('--output', type=str, default='', help='path of the JSON report')
+    parser.add_argument('--baseline', type=str, default='', help='path of a baseline JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown flagged as a regression')
+    opt = parser.parse_args()
+    return opt
+
+def main(opt):
+    report = run_benchmarks(opt.images, opt.spots, opt.cars, opt.width, opt.height, opt.rows, opt.repeat, seed=opt.seed)
+
+    if opt.output:
+        with open(opt.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to {opt.output} ✅")
+    else:
+        print(json.dumps(report, indent=4))
+
+    if opt.baseline:
+        with open(opt.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare_reports(report, baseline, opt.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,515 @@
+# utils/dataset.py
+
+# pylint: disable=unsubscriptable-object
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import numpy as np
+import cv2
+import os
+import re
+import json
+import shutil
+import hashlib
+import argparse
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from utils.geometry import write_atomic, list_files, load_labels, save_labels
+    from utils.model_resolution import ROOT
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from geometry import write_atomic, list_files, load_labels, save_labels
+    from model_resolution import ROOT
+
+
+# Function to split the dataset train and val sets
+def split_dataset(data_path: str, train_size: float = 0.8):
+    # lets put all the train.txt and val.txt info into a list
+    full_list = []
+    train_list = []
+    val_list = []
+    
+    # Get the names of the files in image folder
+    for file in list_files(os.path.join(data_path, 'fold_0/images')):
+        # Appends the path of the image to the list
+        if file.endswith('.jpg'):
+            full_list.append('./images/' + file + '\n')
+
+    # Shuffle the list
+    np.random.shuffle(full_list)
+
+    # Split the list into train and val lists
+    train_size = int(len(full_list) * train_size)
+    train_list = full_list[:train_size]
+    train_list_rotated = [x.replace('.jpg', '_rotated.jpg') for x in train_list]
+    train_list_rotated2 = [x.replace('.jpg', '_rotated2.jpg') for x in train_list]
+
+    val_list = full_list[train_size:]
+    val_list_rotated = [x.replace('.jpg', '_rotated.jpg') for x in val_list]
+    val_list_rotated2 = [x.replace('.jpg', '_rotated2.jpg') for x in val_list]
+
+    # Write the train.txt file to fold 0
+    with open(os.path.join(data_path, 'fold_0/train.txt'), 'w') as f:
+        f.writelines(train_list)
+        f.writelines(train_list_rotated)
+        f.writelines(train_list_rotated2)
+
+    # Write the val.txt file to fold 0
+    with open(os.path.join(data_path, 'fold_0/val.txt'), 'w') as f:
+        f.writelines(val_list)
+
+    # Write the train.txt file to fold 1
+    with open(os.path.join(data_path, 'fold_1/train.txt'), 'w') as f:
+        f.writelines(val_list)
+        f.writelines(val_list_rotated)
+        f.writelines(val_list_rotated2)
+
+    # Write the val.txt file to fold 1
+    with open(os.path.join(data_path, 'fold_1/val.txt'), 'w') as f:
+        f.writelines(train_list)
+
+    print("Dataset split into train and val sets ✅")
+
+def only_car_label(labels_path):
+    # Loop over all labels
+    for file in list_files(labels_path):
+        if file.endswith('.txt'):
+            # Delete all labels that are not cars
+            labels = load_labels(os.path.join(labels_path, file))
+            save_labels(os.path.join(labels_path, file), labels[labels[:, 0] == 0])
+                    
+    print("Only car labels left ✅")
+
+
+# Function to rotate YOLO boxes (N,5) with a rotation matrix, returns the (N,5) axis-aligned boxes around them
+# All the box corners are transformed in a single cv2.transform call
+def rotate_bboxes(bboxes, rotation_matrix, width, height):
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 5)
+    if len(boxes) == 0:
+        return boxes
+
+    class_names, cx, cy, bbox_width, bbox_height = boxes.T
+
+    # Convert to absolute coordinates
+    x_min = ((cx - bbox_width / 2) * width).astype(np.int64)
+    y_min = ((cy - bbox_height / 2) * height).astype(np.int64)
+    x_max = ((cx + bbox_width / 2) * width).astype(np.int64)
+    y_max = ((cy + bbox_height / 2) * height).astype(np.int64)
+
+    # Rotate the 4 corners of every box at once
+    corners = np.stack([x_min, y_min, x_max, y_min, x_min, y_max, x_max, y_max], axis=1).reshape(1, -1, 2)
+    rotated_corners = cv2.transform(corners, rotation_matrix).reshape(-1, 4, 2)
+    x_min_rot, y_min_rot = rotated_corners.min(axis=1).T
+    x_max_rot, y_max_rot = rotated_corners.max(axis=1).T
+
+    # Convert back to relative coordinates
+    x_min_rot_rel = x_min_rot / width
+    y_min_rot_rel = y_min_rot / height
+    x_max_rot_rel = x_max_rot / width
+    y_max_rot_rel = y_max_rot / height
+
+    return np.column_stack([
+        class_names,
+        (x_min_rot_rel + x_max_rot_rel) / 2, # New center
+        (y_min_rot_rel + y_max_rot_rel) / 2,
+        x_max_rot_rel - x_min_rot_rel, # New width and height
+        y_max_rot_rel - y_min_rot_rel
+    ])
+
+# Rotate images for data augmentation
+def rotate_image_and_bboxes(image, bboxes, angle):
+    height, width = image.shape[:2]
+    center = (width // 2, height // 2)
+
+    # Get the rotation matrix
+    rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+
+    # Rotate the image
+    rotated_image = cv2.warpAffine(image, rotation_matrix, (width, height))
+
+    # Update the coordinates of the bounding boxes
+    rotated_bboxes = rotate_bboxes(bboxes, rotation_matrix, width, height)
+
+    return rotated_image, rotated_bboxes.tolist()
+
+
+# Verify if the rotated_bbox is inside the image, if not, ignore this bbox
+# Returns an array for an array of boxes, a list otherwise
+def verify_bboxes(bboxes):
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 5)
+    inside = (boxes[:, 1] >= 0.0) & (boxes[:, 1] <= 1.0) & (boxes[:, 2] >= 0.0) & (boxes[:, 2] <= 1.0)
+    return boxes[inside] if isinstance(bboxes, np.ndarray) else boxes[inside].tolist()
+
+# Suffix of the files of each rotation: _rotated, _rotated2, _rotated3...
+def rotation_suffix(index: int):
+    return '_rotated' if index == 0 else f'_rotated{index + 1}'
+
+def _init_augmentation_worker():
+    cv2.setNumThreads(1) # One image per core, avoid oversubscribing the CPU
+
+# Function to write the rotations of one image and its labels
+def _augment_image(images_path, labels_path, file, angles):
+    # Open image
+    image = cv2.imread(os.path.join(images_path, file))
+    height, width = image.shape[:2]
+    center = (width // 2, height // 2)
+
+    # Open labels in .txt
+    bboxes = load_labels(os.path.join(labels_path, file.replace('.jpg', '.txt')))
+
+    for index, angle in enumerate(angles):
+        suffix = rotation_suffix(index)
+
+        # Rotate image and update bounding boxes coordinates
+        rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        rotated_image = cv2.warpAffine(image, rotation_matrix, (width, height))
+
+        # Verify if the rotated_bbox is inside the image, if not, ignore this bbox
+        rotated_bboxes = verify_bboxes(rotate_bboxes(bboxes, rotation_matrix, width, height))
+
+        # Create new file with rotated_bboxes
+        save_labels(os.path.join(labels_path, file.replace('.jpg', f'{suffix}.txt')), rotated_bboxes)
+
+        # Now you can save the rotated image and the new bounding boxes coordinates
+        cv2.imwrite(os.path.join(images_path, file.replace('.jpg', f'{suffix}.jpg')), rotated_image)
+
+# Data augmentation function with rotation
+# Each train image gets one rotated copy per angle (files suffixed _rotated, _rotated2, ...)
+# workers is the number of processes used to rotate the images (0 = all cores, 1 = no process pool)
+def data_augmentation(data_path, train_txt, angles=(30, 60), workers: int = 0):
+    train_list = []
+    with open(os.path.join(data_path, train_txt), 'r') as f:
+        train_list = f.readlines()
+
+    images_path = os.path.join(data_path, 'images')
+    labels_path = os.path.join(data_path, 'labels')
+
+    # now leave only the last name without \n
+    train_set = {(x.split('/')[-1].split('.')[0]) + '.jpg' for x in train_list}
+
+    # Train images of the folder
+    files = [file for file in list_files(images_path) if file in train_set and file.endswith('.jpg')]
+    _augment_images(images_path, labels_path, files, angles, workers)
+    
+    print("Data augmentation done ✅")
+
+# Function to write the rotations of the images files, in a process pool if workers > 1 (0 = all cores)
+def _augment_images(images_path, labels_path, files, angles, workers: int = 0):
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(len(files), 1))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_augmentation_worker) as executor:
+            futures = [executor.submit(_augment_image, images_path, labels_path, file, list(angles)) for file in files]
+            for future in futures:
+                future.result()
+    else:
+        for file in files:
+            _augment_image(images_path, labels_path, file, list(angles))
+
+
+# Dataset yielding (image, boxes) pairs of the train images with the rotations applied lazily at read time,
+# instead of writing rotated copies to disk with data_augmentation
+# - image_files: names of the images to use (e.g. read_manifest('train.txt')), default all the images of data_path
+# - angles: fixed rotation angles, or angle_range: (min, max) range of the random angles, rotations per image
+# - seed: random angles are drawn per (seed, epoch, image), so they are reproducible and change with set_epoch()
+# - cache_size: number of decoded source images kept in memory (LRU), 0 to disable
+# - labels_path: labels folder (e.g. a car-only label tree), default data_path/labels
+# The dataset can be indexed and iterated, and used as a map-style dataset by a torch DataLoader
+class AugmentedDataset:
+    def __init__(self, data_path: str, image_files=None, angles=(30, 60), angle_range=None, rotations: int = 2, include_original: bool = True, seed: int = 0, cache_size: int = 0, labels_path: str = ''):
+        self.images_path = os.path.join(data_path, 'images')
+        self.labels_path = labels_path or os.path.join(data_path, 'labels')
+        if image_files is None:
+            image_files = list_files(self.images_path)
+        self.image_files = list(image_files)
+
+        self.angles = list(angles) if angle_range is None else None
+        self.angle_range = angle_range
+        self.rotations = len(self.angles) if self.angles is not None else rotations
+        self.include_original = include_original
+        self.seed = seed
+        self.epoch = 0
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    # Each image gives its original (if included) then one item per rotation
+    def _items_per_image(self):
+        return self.rotations + self.include_original
+
+    def __len__(self):
+        return len(self.image_files) * self._items_per_image()
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    # Function to get the rotation angle of an item, None for an original image
+    def angle(self, index: int):
+        image_index, rotation = divmod(index, self._items_per_image())
+        rotation -= self.include_original
+        if rotation < 0:
+            return None
+        if self.angles is not None:
+            return self.angles[rotation]
+        rng = np.random.default_rng([self.seed, self.epoch, image_index])
+        return float(rng.uniform(*self.angle_range, size=self.rotations)[rotation])
+
+    # Function to read a source image and its labels, through the LRU cache
+    def _read(self, image_file: str):
+        if image_file in self._cache:
+            self._cache.move_to_end(image_file)
+            return self._cache[image_file]
+
+        image = cv2.imread(os.path.join(self.images_path, image_file))
+        if image is None:
+            raise ValueError(f'Could not read image {image_file}')
+        labels = load_labels(os.path.join(self.labels_path, os.path.splitext(image_file)[0] + '.txt'))
+
+        if self.cache_size > 0:
+            self._cache[image_file] = (image, labels)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return image, labels
+
+    # Function to get an item: the BGR image and its (N,5) YOLO boxes
+    def __getitem__(self, index: int):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        image, labels = self._read(self.image_files[index // self._items_per_image()])
+        angle = self.angle(index)
+        if angle is None:
+            return image.copy(), labels.copy()
+
+        rotated_image, rotated_bboxes = rotate_image_and_bboxes(image, labels, angle)
+        # Verify if the rotated_bbox is inside the image, if not, ignore this bbox
+        return rotated_image, verify_bboxes(np.array(rotated_bboxes, dtype=np.float64).reshape(-1, 5))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    # Function to write the items to output_path for trainers that need files, returns the manifest path
+    # Originals are listed in place when they use the default labels folder, otherwise they are hardlinked;
+    # rotated images are written as <image>_rotated.jpg, <image>_rotated2.jpg, ... with their labels
+    def export_manifest(self, output_path: str, manifest_name: str = 'train.txt'):
+        output_images_path = os.path.join(output_path, 'images')
+        output_labels_path = os.path.join(output_path, 'labels')
+        os.makedirs(output_images_path, exist_ok=True)
+        os.makedirs(output_labels_path, exist_ok=True)
+        default_labels = os.path.abspath(self.labels_path) == os.path.abspath(os.path.join(os.path.dirname(self.images_path), 'labels'))
+
+        manifest = []
+        for index in range(len(self)):
+            image_file = self.image_files[index // self._items_per_image()]
+            name, extension = os.path.splitext(image_file)
+            rotation = index % self._items_per_image() - self.include_original
+
+            if rotation < 0:
+                if default_labels:
+                    manifest.append(os.path.abspath(os.path.join(self.images_path, image_file)))
+                    continue
+                # The labels are not next to the image, link the image next to a copy of its labels
+                image_path = os.path.join(output_images_path, image_file)
+                if not os.path.exists(image_path):
+                    try:
+                        os.link(os.path.join(self.images_path, image_file), image_path)
+                    except OSError: # Other file system
+                        shutil.copyfile(os.path.join(self.images_path, image_file), image_path)
+                save_labels(os.path.join(output_labels_path, name + '.txt'), self._read(image_file)[1])
+            else:
+                image, labels = self[index]
+                image_path = os.path.join(output_images_path, name + rotation_suffix(rotation) + extension)
+                save_labels(os.path.join(output_labels_path, name + rotation_suffix(rotation) + '.txt'), labels)
+                cv2.imwrite(image_path, image)
+            manifest.append(os.path.abspath(image_path))
+
+        manifest_path = os.path.join(output_path, manifest_name)
+        with open(manifest_path, 'w') as f:
+            f.writelines(path + '\n' for path in manifest)
+
+        print(f"Manifest exported to {manifest_path} ✅")
+        return manifest_path
+
+# Function to read the image file names of a manifest (e.g. train.txt)
+def read_manifest(manifest_path: str):
+    with open(manifest_path, 'r') as f:
+        return [os.path.basename(line.strip()) for line in f if line.strip()]
+
+
+## K-fold preparation ##
+# The folds are train.txt/val.txt manifests and YAMLs pointing at a single tree of the dataset:
+# <output_path>/source/images holds hardlinks to the source images (plus the rotated train images),
+# <output_path>/source/labels the car-only labels (hardlinked when a label file only has cars)
+
+# File keeping the content hash of the inputs of the last k-fold preparation
+KFOLD_STATE_FILE = '.kfold_state.json'
+
+# Function to hardlink a file (copy it on another file system), replacing the destination
+def link_file(source: str, destination: str):
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+# Function to get the content hash of the files of a folder, only rehashing the files whose size or mtime changed
+# cache is the {file: [size, mtime_ns, hash]} dict of the previous call, it is updated
+def hash_files(folder: str, files, cache):
+    hashes = {}
+    for file in files:
+        stat = os.stat(os.path.join(folder, file))
+        cached = cache.get(file)
+        if cached is None or cached[0] != stat.st_size or cached[1] != stat.st_mtime_ns:
+            digest = hashlib.sha1()
+            with open(os.path.join(folder, file), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            cached = cache[file] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        hashes[file] = cached[2]
+    return hashes
+
+# Function to prepare k folds of data_path for YOLO training without copying the dataset
+# - The images are split in k folds with a seeded shuffle, fold i validates on split i and trains on the others
+# - The train manifests also list the rotations of the train images (angles, files suffixed _rotated, _rotated2, ...)
+# - car_only keeps only the car labels (class 0), like only_car_label
+# - yaml_path is the path template of the YAML of each fold, default <output_path>/fold_{fold}/dataset.yaml
+# Nothing is done if the content of the inputs and the parameters didn't change since the last run
+# Returns the YAML paths
+def prepare_kfold(data_path: str, output_path: str, k: int = 2, seed: int = 0, angles=(30, 60), car_only: bool = True, yaml_path: str = '', workers: int = 0):
+    import yaml
+
+    images_path = os.path.join(data_path, 'images')
+    labels_path = os.path.join(data_path, 'labels')
+    tree_images_path = os.path.join(output_path, 'source', 'images')
+    tree_labels_path = os.path.join(output_path, 'source', 'labels')
+    yaml_path = yaml_path or os.path.join(output_path, 'fold_{fold}', 'dataset.yaml')
+    yaml_paths = [yaml_path.format(fold=fold) for fold in range(k)]
+
+    image_files = [file for file in list_files(images_path) if file.endswith('.jpg')]
+    label_files = [file.replace('.jpg', '.txt') for file in image_files]
+
+    # Content hash of the inputs and the parameters
+    state_path = os.path.join(output_path, KFOLD_STATE_FILE)
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError): # First run or corrupted state
+        state = {'images': {}, 'labels': {}, 'key': ''}
+    image_hashes = hash_files(images_path, image_files, state['images'])
+    label_hashes = hash_files(labels_path, [file for file in label_files if os.path.exists(os.path.join(labels_path, file))], state['labels'])
+    with open(os.path.join(data_path, 'dataset.yaml'), 'r') as f:
+        dataset_yaml = f.read()
+    key = hashlib.sha256(json.dumps({
+        'images': image_hashes, 'labels': label_hashes, 'yaml': dataset_yaml,
+        'k': k, 'seed': seed, 'angles': list(angles), 'car_only': car_only, 'yaml_paths': yaml_paths
+    }, sort_keys=True).encode()).hexdigest()
+
+    # Entry of each image in the shared tree: its rotations depend on the image, its labels, the angles and car_only
+    def tree_entry(file):
+        return [image_hashes[file], label_hashes.get(file.replace('.jpg', '.txt')), list(angles), car_only]
+
+    # Function to check that every rotation of an image is on disk
+    def has_rotations(file):
+        return all(
+            os.path.exists(os.path.join(tree_images_path, file.replace('.jpg', rotation_suffix(index) + '.jpg'))) and
+            os.path.exists(os.path.join(tree_labels_path, file.replace('.jpg', rotation_suffix(index) + '.txt')))
+            for index in range(len(angles))
+        )
+
+    if key == state['key'] and all(os.path.exists(path) for path in yaml_paths) and all(has_rotations(file) for file in image_files):
+        print(f"Folds already up to date in {output_path} ✅")
+        return yaml_paths
+
+    os.makedirs(tree_images_path, exist_ok=True)
+    os.makedirs(tree_labels_path, exist_ok=True)
+
+    # Images whose content or rotation settings changed since the last run, or with missing rotations, need new rotations
+    previous_tree = state.get('tree', {})
+    changed = [file for file in image_files if previous_tree.get(file) != tree_entry(file) or not has_rotations(file)]
+
+    # Link the images and write the car-only labels, the label files that only have cars are linked
+    for image_file, label_file in zip(image_files, label_files):
+        link_file(os.path.join(images_path, image_file), os.path.join(tree_images_path, image_file))
+        if not os.path.exists(os.path.join(labels_path, label_file)):
+            save_labels(os.path.join(tree_labels_path, label_file), np.empty((0, 5)))
+            continue
+        labels = load_labels(os.path.join(labels_path, label_file))
+        if car_only and (labels[:, 0] != 0).any():
+            if os.path.exists(os.path.join(tree_labels_path, label_file)):
+                os.remove(os.path.join(tree_labels_path, label_file)) # Don't write through a hardlink to the source
+            save_labels(os.path.join(tree_labels_path, label_file), labels[labels[:, 0] == 0])
+        else:
+            link_file(os.path.join(labels_path, label_file), os.path.join(tree_labels_path, label_file))
+
+    # Every image is a train image of k - 1 folds, so the rotations are written once for all the folds
+    _augment_images(tree_images_path, tree_labels_path, changed, angles, workers)
+
+    # Remove the files of the images that are not in the dataset anymore
+    expected = set()
+    for image_file in image_files:
+        name = image_file[:-len('.jpg')]
+        for suffix in [''] + [rotation_suffix(index) for index in range(len(angles))]:
+            expected.update({name + suffix + '.jpg', name + suffix + '.txt'})
+    for folder in (tree_images_path, tree_labels_path):
+        for entry in os.scandir(folder):
+            if entry.is_file() and entry.name not in expected:
+                os.remove(entry.path)
+
+    # Split the images in k folds
+    order = np.random.default_rng(seed).permutation(len(image_files))
+    splits = np.array_split(order, k)
+
+    for fold, fold_yaml_path in enumerate(yaml_paths):
+        fold_path = os.path.join(output_path, f'fold_{fold}')
+        os.makedirs(fold_path, exist_ok=True)
+
+        val_files = [image_files[i] for i in splits[fold]]
+        train_files = [image_files[i] for split in splits[:fold] + splits[fold + 1:] for i in split]
+        train_list = [os.path.abspath(os.path.join(tree_images_path, file)) + '\n' for file in train_files]
+        train_list += [os.path.abspath(os.path.join(tree_images_path, file.replace('.jpg', rotation_suffix(index) + '.jpg'))) + '\n' for index in range(len(angles)) for file in train_files]
+
+        with open(os.path.join(fold_path, 'train.txt'), 'w') as f:
+            f.writelines(train_list)
+        with open(os.path.join(fold_path, 'val.txt'), 'w') as f:
+            f.writelines(os.path.abspath(os.path.join(tree_images_path, file)) + '\n' for file in val_files)
+
+        # YAML of the fold, from the dataset YAML
+        yaml_file = yaml.safe_load(dataset_yaml)
+        yaml_file['path'] = os.path.abspath(fold_path)
+        yaml_file['train'] = os.path.abspath(os.path.join(fold_path, 'train.txt'))
+        yaml_file['val'] = os.path.abspath(os.path.join(fold_path, 'val.txt'))
+        os.makedirs(os.path.dirname(os.path.abspath(fold_yaml_path)), exist_ok=True)
+        with open(fold_yaml_path, 'w') as f:
+            yaml.dump(yaml_file, f)
+
+    # Remove the folds of a previous run with more folds
+    for entry in os.scandir(output_path):
+        match = re.fullmatch(r'fold_(\d+)', entry.name)
+        if entry.is_dir() and match and int(match.group(1)) >= k:
+            shutil.rmtree(entry.path)
+
+    state.update({
+        'key': key,
+        'images': {file: state['images'][file] for file in image_hashes},
+        'labels': {file: state['labels'][file] for file in label_hashes},
+        'tree': {file: tree_entry(file) for file in image_files}
+    })
+    write_atomic(state_path, json.dumps(state).encode())
+
+    print(f"{k} folds prepared in {output_path} ✅")
+    return yaml_paths
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reporoot', type=str, default=ROOT, help='path to repo root')
+    parser.add_argument('--folds', type=int, default=2, help='number of folds')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the folds split')
+    opt = parser.parse_args()
+    return opt
@@ -0,0 +1,209 @@
+# utils/detection_cache.py
+
+# Content-addressed cache of the detected cars, so rerunning the occupancy analysis with another threshold
+# or new report columns on the same images and weights skips the inference
+
+import numpy as np
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+## Keys ##
+
+# Function to hash bytes (16 bytes blake2b, as hex)
+def content_hash(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Function to hash the content of a file
+def file_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to hash a decoded image (its shape and pixels), for frames that have no file
+def image_hash(image) -> str:
+    digest = hashlib.blake2b(str(image.shape).encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+# Hash of each weights file, by (path, size, mtime) so a file is only hashed once
+_WEIGHTS_HASHES = {}
+
+# Function to hash a weights file, only rehashed when its size or mtime changed
+# A pre-trained model given by name (e.g. yolov8n.pt, downloaded by the YOLO packages) is not a file here,
+# its name is hashed instead (the YOLO version is part of the detector settings)
+def weights_hash(path: str) -> str:
+    if not os.path.isfile(path):
+        return content_hash(f'name:{os.path.basename(path)}'.encode())
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _WEIGHTS_HASHES:
+        _WEIGHTS_HASHES[key] = file_hash(path)
+    return _WEIGHTS_HASHES[key]
+
+# Attributes of a detector that don't change its detections
+_IGNORED_ATTRIBUTES = {'model', 'batch_size', 'tile_batch_size'}
+
+# Function to get the key of the detections of a detector: the hash of its weights and settings (conf, iou, imgsz, ...)
+# Works with Detector, OnnxDetector and TiledDetector (the wrapped detector is part of the key)
+def detector_key(detector) -> str:
+    settings = {'type': type(detector).__name__}
+    for name, value in vars(detector).items():
+        if name.startswith('_') or name in _IGNORED_ATTRIBUTES:
+            continue
+        if name == 'model_path':
+            settings['weights'] = weights_hash(value)
+        elif name == 'detector':
+            settings['detector'] = detector_key(value)
+        elif isinstance(value, (bool, int, float, str, list, tuple)):
+            settings[name] = value
+    return content_hash(json.dumps(settings, sort_keys=True).encode())
+
+
+## Cache ##
+
+# SQLite store of the cars detected in each image, as (K,4) float64 YOLO boxes (x_center, y_center, width, height)
+# The least recently used entries are evicted when the store grows above max_size_mb
+# The store can be shared by threads (e.g. the service scheduler), and by processes through the SQLite file
+class DetectionCache:
+    def __init__(self, path: str, max_size_mb: float = 256):
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS detections (key TEXT PRIMARY KEY, boxes BLOB NOT NULL, size INTEGER NOT NULL, last_used INTEGER NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used)')
+        self.size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM detections').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM detections').fetchone()[0]
+
+    # Function to get the cars of many keys, returns {key: (K,5) car labels} for the cached keys
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # SQLite limits the number of parameters of a query
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(f'SELECT key, boxes FROM detections WHERE key IN ({",".join("?" * len(chunk))})', chunk).fetchall()
+                for key, boxes in rows:
+                    boxes = np.frombuffer(boxes, dtype=np.float64).reshape(-1, 4)
+                    found[key] = np.column_stack([np.zeros(len(boxes)), boxes])
+            if found:
+                now = time.time_ns()
+                self._connection.executemany('UPDATE detections SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    # Function to get the cars of a key, None if it is not cached
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    # Function to store the (K,5) car labels of many keys, given as a {key: labels} dict
+    def put_many(self, items):
+        rows = []
+        for key, labels in items.items():
+            boxes = np.ascontiguousarray(np.asarray(labels, dtype=np.float64).reshape(-1, 5)[:, 1:]).tobytes()
+            rows.append((key, boxes, len(key) + len(boxes), time.time_ns()))
+
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                for row in rows:
+                    previous = self._connection.execute('SELECT size FROM detections WHERE key = ?', row[:1]).fetchone()
+                    self.size -= previous[0] if previous else 0
+                    self._connection.execute('INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?)', row)
+                    self.size += row[2]
+                self._evict()
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                self.size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM detections').fetchone()[0]
+                raise
+
+    # Function to store the cars of a key
+    def put(self, key: str, labels):
+        self.put_many({key: labels})
+
+    # Function to delete the least recently used entries until the store fits in max_size
+    def _evict(self):
+        while self.size > self.max_size:
+            rows = self._connection.execute('SELECT key, size FROM detections ORDER BY last_used LIMIT 256').fetchall()
+            if not rows:
+                self.size = 0
+                return
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+            self._connection.executemany('DELETE FROM detections WHERE key = ?', evicted)
+
+    # Function to delete every entry
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM detections')
+            self.size = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# Detector consulting a DetectionCache before running another detector, with the same predict interface
+# The entries are keyed by the content hash of the image and the weights and settings of the detector
+# (see detector_key), so changing the model, conf, iou or imgsz never returns stale cars
+class CachedDetector:
+    def __init__(self, detector, cache):
+        self.detector = detector
+        self.cache = cache
+        self.model = detector.model
+        self.car_classes = detector.car_classes
+        self.batch_size = detector.batch_size
+        self.key = detector_key(detector)
+
+    # Function to get the cached cars of images given by their content hash (e.g. file_hash), None for the misses
+    def cached(self, content_hashes):
+        found = self.cache.get_many([f'{self.key}:{h}' for h in content_hashes])
+        return [found.get(f'{self.key}:{h}') for h in content_hashes]
+
+    # Function to detect the cars of a list of BGR images, only the images that are not cached are run through the detector
+    # content_hashes identify the images in the cache (default: image_hash of each image)
+    def predict(self, images, content_hashes=None):
+        if content_hashes is None:
+            content_hashes = [image_hash(image) for image in images]
+
+        labels = self.cached(content_hashes)
+        missing = [index for index, cars in enumerate(labels) if cars is None]
+        if missing:
+            detected = self.predict_missing([images[index] for index in missing], [content_hashes[index] for index in missing])
+            for index, cars in zip(missing, detected):
+                labels[index] = cars
+        return labels
+
+    # Function to detect the cars of images already known to be missing from the cache (see cached), and store them
+    def predict_missing(self, images, content_hashes):
+        labels = self.detector.predict(images)
+        self.cache.put_many({f'{self.key}:{content_hash}': cars for content_hash, cars in zip(content_hashes, labels)})
+        return labels
+
+    # The raw detections (every class, with confidences) are not cached
+    def detect(self, images):
+        return self.detector.detect(images)
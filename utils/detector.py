@@ -0,0 +1,495 @@
+# utils/detector.py
+
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import numpy as np
+import pandas as pd
+import cv2
+import os
+import ast
+import time
+import json
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from utils.functions import ROOT, is_custom_model, iou_matrix, load_labels, yolo_to_pixel_boxes, LayoutRegistry, list_files, draw_bounding_boxes, peak_rss_mb
+    from utils.detection_cache import DetectionCache, CachedDetector
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from functions import ROOT, is_custom_model, iou_matrix, load_labels, yolo_to_pixel_boxes, LayoutRegistry, list_files, draw_bounding_boxes, peak_rss_mb
+    from detection_cache import DetectionCache, CachedDetector
+
+
+# In-process YOLOv5/YOLOv8 detector: the weights are loaded once and the model stays in memory,
+# so the cars of each frame go straight to the occupancy step as arrays, without label files
+class Detector:
+    def __init__(self, model: str, yoloversion: str = '8', conf: float = 0.25, iou: float = 0.45, imgsz: int = 1920, batch_size: int = 4, device: str = 'cpu'):
+        self.model, self.model_path = is_custom_model(model, yoloversion)
+        self.yoloversion = yoloversion
+        self.conf = conf
+        self.iou = iou
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+        self.device = device
+
+        self._model = self._load()
+
+        # Our models only detect cars (class 0), the pre-trained ones use the COCO 'car' class
+        names = self._model.names
+        names = names.items() if isinstance(names, dict) else enumerate(names)
+        self.car_classes = [int(class_id) for class_id, name in names if name == 'car'] or [0]
+
+    def _load(self):
+        if self.yoloversion == '5':
+            import yolov5
+
+            model = yolov5.load(self.model_path, device=self.device)
+            model.conf = self.conf
+            model.iou = self.iou
+            return model
+
+        from ultralytics import YOLO
+
+        return YOLO(self.model_path)
+
+    # Run the model on a batch of BGR images
+    def _infer(self, images):
+        if self.yoloversion == '5':
+            # YOLOv5 AutoShape expects RGB arrays
+            results = self._model([image[..., ::-1] for image in images], size=self.imgsz)
+            return [detections.cpu().numpy() for detections in results.xyxy]
+
+        results = self._model.predict(images, imgsz=self.imgsz, conf=self.conf, iou=self.iou, device=self.device, verbose=False)
+        return [
+            np.concatenate([
+                result.boxes.xyxy.cpu().numpy(),
+                result.boxes.conf.cpu().numpy()[:, None],
+                result.boxes.cls.cpu().numpy()[:, None]
+            ], axis=1)
+            for result in results
+        ]
+
+    # Function to detect the objects of a list of BGR images, batch_size images at a time
+    # Returns one (M,6) array per image: left, top, right, bottom (pixels), confidence, class
+    def detect(self, images):
+        detections = []
+        for start in range(0, len(images), self.batch_size):
+            detections.extend(self._infer(images[start:start + self.batch_size]))
+        return [np.asarray(d, dtype=np.float64).reshape(-1, 6) for d in detections]
+
+    # Function to detect the cars of a list of BGR images
+    # Returns one (M,5) array per image in the YOLO label format, with the cars as class 0 like in our labels
+    def predict(self, images):
+        labels = []
+        for image, detections in zip(images, self.detect(images)):
+            labels.append(detections_to_labels(detections, image.shape[1], image.shape[0], self.car_classes))
+        return labels
+
+
+# Function to convert (M,6) pixel detections to (K,5) YOLO car labels (class 0, x_center, y_center, width, height)
+def detections_to_labels(detections, image_width, image_height, car_classes=(0,)):
+    detections = np.asarray(detections, dtype=np.float64).reshape(-1, 6)
+    cars = detections[np.isin(detections[:, 5], car_classes)]
+
+    labels = np.zeros((len(cars), 5), dtype=np.float64)
+    labels[:, 1] = (cars[:, 0] + cars[:, 2]) / 2 / image_width
+    labels[:, 2] = (cars[:, 1] + cars[:, 3]) / 2 / image_height
+    labels[:, 3] = (cars[:, 2] - cars[:, 0]) / image_width
+    labels[:, 4] = (cars[:, 3] - cars[:, 1]) / image_height
+    return labels
+
+
+# Function to compute the overlap between one box (4,) and many boxes (N,4)
+# match_metric 'iou' is the intersection over union, 'ios' the intersection over the smaller box area,
+# which also matches the partial boxes of a car cut by a tile border with its full box
+def box_overlaps(box, boxes, match_metric: str = 'iou'):
+    ious = iou_matrix(box[None, :], boxes)[0]
+    if match_metric == 'iou':
+        return ious
+
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    # IoU = I / (A + B - I), so I = IoU * (A + B) / (1 + IoU)
+    intersections = ious * (area + areas) / (1 + ious)
+    smaller_areas = np.minimum(area, areas)
+    ios = np.zeros(len(boxes), dtype=np.float64)
+    np.divide(intersections, smaller_areas, out=ios, where=smaller_areas > 0)
+    return ios
+
+# Function to keep the best boxes among overlapping ones (greedy NMS), returns the indices of the kept boxes
+def nms(boxes, scores, iou_threshold, match_metric: str = 'iou'):
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        overlaps = box_overlaps(boxes[best], boxes[order[1:]], match_metric)
+        order = order[1:][overlaps <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+# Function to merge duplicated (M,6) detections of the same class, e.g. a car detected in two overlapping tiles
+# method 'nms' keeps the best box of each group, 'wbf' fuses each group into its confidence-weighted mean box
+def merge_detections(detections, iou_threshold: float = 0.5, method: str = 'nms', match_metric: str = 'ios'):
+    detections = np.asarray(detections, dtype=np.float64).reshape(-1, 6)
+    merged = []
+    for class_id in np.unique(detections[:, 5]):
+        class_detections = detections[detections[:, 5] == class_id]
+        boxes, scores = class_detections[:, :4], class_detections[:, 4]
+
+        if method == 'nms':
+            merged.append(class_detections[nms(boxes, scores, iou_threshold, match_metric)])
+            continue
+
+        # Weighted boxes fusion: each group is the best remaining box and the boxes overlapping it
+        remaining = np.argsort(-scores, kind='stable')
+        while remaining.size:
+            grouped = np.concatenate([[True], box_overlaps(boxes[remaining[0]], boxes[remaining[1:]], match_metric) > iou_threshold])
+            group = remaining[grouped]
+            weights = scores[group] / scores[group].sum()
+            fused_box = (boxes[group] * weights[:, None]).sum(axis=0)
+            merged.append(np.concatenate([fused_box, [scores[group].max(), class_id]])[None, :])
+            remaining = remaining[~grouped]
+
+    if not merged:
+        return np.empty((0, 6), dtype=np.float64)
+    return np.concatenate(merged)
+
+
+## Tiled inference ##
+
+# Function to get the (left, top) origins of the tiles covering an image
+# The tiles overlap by the overlap fraction, and the last tile of each row/column is aligned with the image border
+def tile_origins(image_width: int, image_height: int, tile_size: int, overlap: float):
+    stride = max(int(tile_size * (1 - overlap)), 1)
+
+    def axis_origins(length):
+        if length <= tile_size:
+            return [0]
+        origins = list(range(0, length - tile_size, stride))
+        return origins + [length - tile_size]
+
+    return [(left, top) for top in axis_origins(image_height) for left in axis_origins(image_width)]
+
+# Detector running another detector over overlapping tiles of each frame, with the same interface as Detector
+# Small cars keep their resolution (e.g. at 60-75 m of altitude), and each batch of tile_batch_size tiles bounds
+# the peak memory. The detections of all tiles are merged back into one array per frame with merge_detections.
+# The wrapped detector should use imgsz = tile_size. full_frame also runs it on the whole frame, for large cars.
+class TiledDetector:
+    def __init__(self, detector, tile_size: int = 640, overlap: float = 0.2, tile_batch_size: int = 8, merge: str = 'nms', merge_iou: float = 0.5, match_metric: str = 'ios', full_frame: bool = False, batch_size: int = 1):
+        self.detector = detector
+        self.model = detector.model
+        self.car_classes = detector.car_classes
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tile_batch_size = tile_batch_size
+        self.merge = merge
+        self.merge_iou = merge_iou
+        self.match_metric = match_metric
+        self.full_frame = full_frame
+        self.batch_size = batch_size
+
+    # Function to detect the objects of a list of BGR images, returns one (M,6) pixel array per image
+    def detect(self, images):
+        # Tiles of every image: (image index, left, top), the crops are views of the images
+        tiles = []
+        for index, image in enumerate(images):
+            tiles.extend((index, left, top) for left, top in tile_origins(image.shape[1], image.shape[0], self.tile_size, self.overlap))
+
+        image_detections = [[] for _ in images]
+        for start in range(0, len(tiles), self.tile_batch_size):
+            batch = tiles[start:start + self.tile_batch_size]
+            crops = [images[index][top:top + self.tile_size, left:left + self.tile_size] for index, left, top in batch]
+
+            for (index, left, top), detections in zip(batch, self.detector.detect(crops)):
+                # Back to the pixels of the whole image
+                detections[:, [0, 2]] += left
+                detections[:, [1, 3]] += top
+                image_detections[index].append(detections)
+
+        if self.full_frame:
+            for index, detections in enumerate(self.detector.detect(images)):
+                image_detections[index].append(detections)
+
+        return [
+            merge_detections(np.concatenate(detections) if detections else np.empty((0, 6)), self.merge_iou, self.merge, self.match_metric)
+            for detections in image_detections
+        ]
+
+    predict = Detector.predict
+
+
+## Exported models ##
+
+# Function to resolve an exported model (.onnx) name or path, like is_custom_model does for .pt weights
+def resolve_onnx_model(model: str):
+    if not model.endswith('.onnx'):
+        model = model + '.onnx'
+    if model.__contains__("/") or model.__contains__("\\"):
+        return model
+    return os.path.join(ROOT, f'models/{model}')
+
+# Function to export .pt weights to ONNX with a dynamic batch size, returns the path of the .onnx file
+def export_onnx(model: str, yoloversion: str = '8', imgsz: int = 1920):
+    _, model_path = is_custom_model(model, yoloversion)
+
+    if yoloversion == '5':
+        from yolov5 import export
+
+        export.run(weights=model_path, include=('onnx',), imgsz=(imgsz, imgsz), dynamic=True)
+        return os.path.splitext(model_path)[0] + '.onnx'
+
+    from ultralytics import YOLO
+
+    return YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True)
+
+# Function to resize an image keeping its aspect ratio and pad it to a (imgsz, imgsz) square, like YOLO does
+# Returns the padded image, the resize ratio and the (left, top) padding
+def letterbox(image, imgsz: int):
+    height, width = image.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    left, top = (imgsz - new_width) // 2, (imgsz - new_height) // 2
+
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    padded[top:top + new_height, left:left + new_width] = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    return padded, ratio, (left, top)
+
+# Function to convert BGR images into a (B,3,imgsz,imgsz) float32 RGB batch
+def images_to_batch(images, imgsz: int):
+    letterboxed = [letterbox(image, imgsz) for image in images]
+    batch = np.stack([padded[..., ::-1].transpose(2, 0, 1) for padded, _, _ in letterboxed]).astype(np.float32) / 255
+    return batch, [(ratio, pad) for _, ratio, pad in letterboxed]
+
+# Calibration images for the INT8 quantization, in the format onnxruntime expects
+class _CalibrationReader:
+    def __init__(self, input_name, image_paths, imgsz):
+        self.input_name = input_name
+        self.image_paths = iter(image_paths)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        image_path = next(self.image_paths, None)
+        if image_path is None:
+            return None
+        batch, _ = images_to_batch([cv2.imread(image_path)], self.imgsz)
+        return {self.input_name: batch}
+
+# Function to quantize an ONNX model to INT8, calibrated on the images of data/images
+# Returns the path of the quantized model ('<name>_int8.onnx')
+def quantize_onnx(onnx_path: str, images_folder: str = os.path.join(ROOT, 'data/images'), imgsz: int = 1920, calibration_images: int = 16):
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    image_paths = sorted(os.path.join(images_folder, f) for f in list_files(images_folder) if f.endswith(('.jpg', '.png')))[:calibration_images]
+
+    quantized_path = os.path.splitext(onnx_path)[0] + '_int8.onnx'
+    quantize_static(
+        onnx_path, quantized_path, _CalibrationReader(input_name, image_paths, imgsz),
+        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+# Detector running an exported ONNX model on the CPU with onnxruntime, with the same interface as Detector
+# providers can select another onnxruntime backend, e.g. ['OpenVINOExecutionProvider'] with onnxruntime-openvino
+class OnnxDetector:
+    def __init__(self, model: str, conf: float = 0.25, iou: float = 0.45, imgsz: int = 1920, batch_size: int = 4, providers=None, threads: int = 0):
+        import onnxruntime as ort
+
+        self.model_path = resolve_onnx_model(model)
+        self.model = os.path.basename(self.model_path)
+        self.conf = conf
+        self.iou = iou
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(self.model_path, options, providers=providers or ['CPUExecutionProvider'])
+        self._input_name = self._session.get_inputs()[0].name
+
+        # Models exported by ultralytics keep the class names, our models only detect cars (class 0)
+        names = self._session.get_modelmeta().custom_metadata_map.get('names')
+        names = ast.literal_eval(names) if names else {}
+        self.car_classes = [int(class_id) for class_id, name in names.items() if name == 'car'] or [0]
+
+    # Function to convert the raw output of one image to (M,6) detections in letterbox pixels
+    def _postprocess(self, output):
+        # YOLOv8: (4 + classes, boxes), YOLOv5: (boxes, 5 + classes) with the objectness in column 4
+        if output.shape[0] < output.shape[1]:
+            output = output.T
+            class_scores = output[:, 4:]
+        else:
+            class_scores = output[:, 5:] * output[:, 4:5]
+
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        mask = scores > self.conf
+        output, scores, classes = output[mask], scores[mask], classes[mask]
+
+        boxes = np.stack([
+            output[:, 0] - output[:, 2] / 2,
+            output[:, 1] - output[:, 3] / 2,
+            output[:, 0] + output[:, 2] / 2,
+            output[:, 1] + output[:, 3] / 2
+        ], axis=1).astype(np.float64)
+
+        # NMS per class, shifting the boxes of each class so they never overlap
+        keep = nms(boxes + classes[:, None] * (4 * self.imgsz), scores, self.iou)
+        return np.concatenate([boxes[keep], scores[keep, None], classes[keep, None]], axis=1)
+
+    def _infer(self, images):
+        batch, transforms = images_to_batch(images, self.imgsz)
+        outputs = self._session.run(None, {self._input_name: batch})[0]
+
+        detections = []
+        for image, output, (ratio, (left, top)) in zip(images, outputs, transforms):
+            image_detections = self._postprocess(output)
+
+            # Back to the pixels of the original image
+            image_detections[:, [0, 2]] = np.clip((image_detections[:, [0, 2]] - left) / ratio, 0, image.shape[1])
+            image_detections[:, [1, 3]] = np.clip((image_detections[:, [1, 3]] - top) / ratio, 0, image.shape[0])
+            detections.append(image_detections)
+        return detections
+
+    detect = Detector.detect
+    predict = Detector.predict
+
+
+# Function to create a detector for .pt weights (runtime='torch') or an exported model (runtime='onnx')
+# cache is the path of a DetectionCache SQLite file (see utils/detection_cache.py), checked before each inference
+def load_detector(model: str, yoloversion: str = '8', runtime: str = 'torch', cache: str = '', cache_size_mb: float = 256, **kwargs):
+    if runtime == 'onnx':
+        detector = OnnxDetector(model, **kwargs)
+    else:
+        detector = Detector(model, yoloversion, **kwargs)
+    if cache:
+        return CachedDetector(detector, DetectionCache(cache, cache_size_mb))
+    return detector
+
+
+## Parity report ##
+
+# Function to compute the COCO-style (101-point) average precision of each IoU threshold for a set of images
+# predictions: one (M,6) pixel array (left, top, right, bottom, confidence, class) per image,
+# ground_truth: one (K,4) pixel boxes array per image
+def average_precision(predictions, ground_truth, iou_thresholds=np.linspace(0.5, 0.95, 10)):
+    iou_thresholds = np.asarray(iou_thresholds)
+    scores, true_positives = [], []
+    total_ground_truth = sum(len(gt) for gt in ground_truth)
+
+    for detections, gt in zip(predictions, ground_truth):
+        detections = detections[np.argsort(-detections[:, 4], kind='stable')]
+        # The IoU matrix is computed once per image and reused for every threshold
+        ious = iou_matrix(detections[:, :4], gt)
+        matches = np.zeros((len(detections), len(iou_thresholds)), dtype=bool)
+        for t, iou_threshold in enumerate(iou_thresholds):
+            matched = np.zeros(len(gt), dtype=bool)
+            for d in range(len(detections)):
+                candidates = np.where(~matched & (ious[d] >= iou_threshold), ious[d], -1)
+                if len(gt) and candidates.max() >= 0:
+                    matched[candidates.argmax()] = True
+                    matches[d, t] = True
+        scores.append(detections[:, 4])
+        true_positives.append(matches)
+
+    scores = np.concatenate(scores)
+    if total_ground_truth == 0 or len(scores) == 0:
+        return np.zeros(len(iou_thresholds))
+
+    order = np.argsort(-scores, kind='stable')
+    true_positives = np.concatenate(true_positives)[order]
+    tp = np.cumsum(true_positives, axis=0)
+    fp = np.cumsum(~true_positives, axis=0)
+    recall = tp / total_ground_truth
+    precision = tp / np.maximum(tp + fp, 1)
+
+    recall_points = np.linspace(0, 1, 101)
+    aps = []
+    for t in range(len(iou_thresholds)):
+        # Precision envelope, then sample it at 101 recall points
+        envelope = np.flip(np.maximum.accumulate(np.flip(precision[:, t])))
+        indices = np.searchsorted(recall[:, t], recall_points, side='left')
+        aps.append(np.where(indices < len(envelope), envelope[np.minimum(indices, len(envelope) - 1)], 0).mean())
+    return np.array(aps)
+
+# Function to evaluate one detector, run in a fresh process so its peak RSS is measured alone
+# The frames are read and detected batch_size at a time, so the peak RSS is the one of the model, not of the dataset,
+# and the detections of each batch give both the mAP and the occupancy counts
+def _evaluate_detector(data_path, detector_kwargs, threshold):
+    detector = load_detector(**detector_kwargs)
+
+    images_folder = os.path.join(data_path, 'images')
+    image_files = list_files(images_folder)
+    layouts = LayoutRegistry(os.path.join(data_path, 'labels'))
+
+    # Warm up, then time the detection only
+    if image_files:
+        detector.detect([cv2.imread(os.path.join(images_folder, image_files[0]))])
+
+    detect_time = 0.0
+    predictions, ground_truth, counts = [], [], []
+    for start in range(0, len(image_files), detector.batch_size):
+        batch_files = image_files[start:start + detector.batch_size]
+        images = [cv2.imread(os.path.join(images_folder, f)) for f in batch_files]
+
+        detect_start = time.perf_counter()
+        detections = detector.detect(images)
+        detect_time += time.perf_counter() - detect_start
+
+        for image_file, image, image_detections in zip(batch_files, images, detections):
+            # Car detections against the car ground truth labels
+            predictions.append(image_detections[np.isin(image_detections[:, 5], detector.car_classes)])
+            labels = load_labels(os.path.join(data_path, 'labels', os.path.splitext(image_file)[0] + '.txt'))
+            ground_truth.append(yolo_to_pixel_boxes(labels[labels[:, 0] == 0, 1:], image.shape[1], image.shape[0]))
+
+            # Occupancy counts of the image, like process_images with this detector
+            cars = detections_to_labels(image_detections, image.shape[1], image.shape[0], detector.car_classes)
+            counts.append(draw_bounding_boxes(os.path.join(images_folder, image_file), cars, '', threshold, True, layouts, render=False, image=image))
+
+    ms_per_frame = detect_time * 1000 / max(len(image_files), 1)
+    aps = average_precision(predictions, ground_truth)
+
+    return {'ms/frame': ms_per_frame, 'Peak RSS (MB)': peak_rss_mb(), 'mAP50': aps[0], 'mAP50-95': aps.mean(), 'counts': counts}
+
+# Function to compare exported/quantized detectors with the reference .pt detector
+# Each detector is given as the load_detector arguments, e.g. {'model': 'yolov8n_fold_0.pt'} or
+# {'model': 'yolov8n_fold_0_int8.onnx', 'runtime': 'onnx'}. Returns a DataFrame with, for each detector, the speed,
+# peak RSS, mAP and, for every occupancy count column, the fraction of images with the same count as the reference
+def parity_report(data_path: str, reference: dict, candidates: dict, threshold: float = 0.4, output_path: str = ''):
+    detectors = {'reference': reference}
+    detectors.update(candidates)
+
+    evaluations = {}
+    context = multiprocessing.get_context('spawn')
+    for name, detector_kwargs in detectors.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            evaluations[name] = executor.submit(_evaluate_detector, data_path, detector_kwargs, threshold).result()
+
+    reference_counts = pd.DataFrame.from_records(evaluations['reference']['counts']).set_index('Image File')
+    rows = []
+    for name, evaluation in evaluations.items():
+        counts = pd.DataFrame.from_records(evaluation['counts']).set_index('Image File').reindex(reference_counts.index)
+        row = {
+            'Model': name,
+            'ms/frame': evaluation['ms/frame'],
+            # No speedup when no frame was timed (empty dataset)
+            'Speedup': evaluations['reference']['ms/frame'] / evaluation['ms/frame'] if evaluation['ms/frame'] else None,
+            'Peak RSS (MB)': evaluation['Peak RSS (MB)'],
+            'mAP50': evaluation['mAP50'],
+            'mAP50-95': evaluation['mAP50-95']
+        }
+        for column in reference_counts.columns:
+            row[f'{column} Agreement'] = (counts[column] == reference_counts[column]).mean()
+        rows.append(row)
+
+    report = pd.DataFrame(rows)
+    if output_path != '':
+        if output_path.endswith('.json'):
+            with open(output_path, 'w') as f:
+                json.dump(report.to_dict(orient='records'), f, indent=2)
+        else:
+            report.to_csv(output_path, index=False)
+    return report
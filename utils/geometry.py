@@ -0,0 +1,234 @@
+# utils/geometry.py
+
+# pylint: disable=unsubscriptable-object
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import numpy as np
+import os
+import re
+import io
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+
+# Function to write a file atomically, so concurrent runs never see or leave a partially written file
+def write_atomic(path: str, data: bytes):
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+# Root folder of the caches (parsed labels, image sizes), outside of the dataset and results folders so that
+# nothing is added to the folders that the training and evaluation scripts list.
+# It can be moved with the YOLO_PARKING_SPOT_CACHE environment variable (also seen by the worker processes),
+# or per call with the cache_dir argument of load_labels and ImageSizeCache
+CACHE_DIR = os.environ.get('YOLO_PARKING_SPOT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'yolo-parking-spot'))
+
+# Function to get the cache folder of a source folder: <cache_dir>/<kind>/<hash of the absolute source folder path>
+def cache_folder(kind: str, source_folder: str, cache_dir: str = ''):
+    source_key = hashlib.blake2b(os.path.abspath(source_folder).encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, kind, source_key)
+
+# Function to list the files of a folder, sorted, skipping the folders and the hidden files (e.g. .DS_Store)
+def list_files(folder: str):
+    return sorted(entry.name for entry in os.scandir(folder) if entry.is_file() and not entry.name.startswith('.'))
+
+# Function to parse YOLO annotation lines into an (N,5) array: class, x_center, y_center, width, height
+def parse_labels(lines):
+    values = [list(map(float, line.split())) for line in lines if line.strip()]
+    return np.array(values, dtype=np.float64).reshape(-1, 5)
+
+# Function to load a YOLO label file as an (N,5) array, reading through a binary cache (see CACHE_DIR)
+def load_labels(label_path: str, use_cache: bool = True, cache_dir: str = ''):
+    # The cache is invalidated when the label file size or modification time changes
+    stat = os.stat(label_path)
+    labels_folder, label_file = os.path.split(label_path)
+    cache_path = os.path.join(cache_folder('labels', labels_folder, cache_dir), os.path.splitext(label_file)[0] + '.npz')
+
+    if use_cache:
+        try:
+            with np.load(cache_path) as cache:
+                if cache['mtime_ns'] == stat.st_mtime_ns and cache['size'] == stat.st_size:
+                    return cache['labels']
+        except (OSError, KeyError, ValueError): # Missing or corrupted cache
+            pass
+
+    with open(label_path, 'r') as f:
+        labels = parse_labels(f.readlines())
+
+    if use_cache:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            cache = io.BytesIO()
+            np.savez(cache, labels=labels, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            write_atomic(cache_path, cache.getvalue())
+        except OSError: # Read-only cache folder, keep working without cache
+            pass
+
+    return labels
+
+# Function to write an (N,5) labels array as a YOLO label file
+def save_labels(label_path: str, labels):
+    with open(label_path, 'w') as f:
+        for class_name, cx, cy, bbox_width, bbox_height in np.asarray(labels, dtype=np.float64).reshape(-1, 5).tolist():
+            f.write(f'{int(class_name)} {cx} {cy} {bbox_width} {bbox_height}\n')
+
+# Function to convert YOLO boxes (x_center, y_center, width, height) to pixel corners (left, top, right, bottom)
+def yolo_to_pixel_boxes(boxes, image_width, image_height):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x_center, y_center, width, height = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+
+    # Same arithmetic as the scalar version, truncated towards zero like int()
+    corners = np.stack([
+        (x_center - width / 2) * image_width,
+        (y_center - height / 2) * image_height,
+        (x_center + width / 2) * image_width,
+        (y_center + height / 2) * image_height
+    ], axis=1)
+
+    return corners.astype(np.int64)
+
+# Function to compute the IoU between every parking spot (N,4) and every car (M,4) in one pass
+# Works for any (left, top, right, bottom) boxes, pixel coordinates are exact in float64
+def iou_matrix(spot_boxes, car_boxes):
+    spot_boxes = np.asarray(spot_boxes, dtype=np.float64).reshape(-1, 4)
+    car_boxes = np.asarray(car_boxes, dtype=np.float64).reshape(-1, 4)
+
+    # Broadcast spots over rows and cars over columns
+    spots = spot_boxes[:, None, :]
+    cars = car_boxes[None, :, :]
+
+    intersection_width = np.clip(np.minimum(spots[..., 2], cars[..., 2]) - np.maximum(spots[..., 0], cars[..., 0]), 0, None)
+    intersection_height = np.clip(np.minimum(spots[..., 3], cars[..., 3]) - np.maximum(spots[..., 1], cars[..., 1]), 0, None)
+    intersection_area = intersection_width * intersection_height
+
+    spot_area = (spots[..., 2] - spots[..., 0]) * (spots[..., 3] - spots[..., 1])
+    car_area = (cars[..., 2] - cars[..., 0]) * (cars[..., 3] - cars[..., 1])
+    union_area = spot_area + car_area - intersection_area
+
+    # Degenerate boxes (zero union) never count as an overlap
+    ious = np.zeros(union_area.shape, dtype=np.float64)
+    np.divide(intersection_area, union_area, out=ious, where=union_area != 0)
+
+    return ious
+
+# Occupancy engine: for each parking spot return if it is occupied, the index of the best matching car and its IoU
+def compute_occupancy(spot_boxes, car_boxes, threshold):
+    ious = iou_matrix(spot_boxes, car_boxes)
+
+    # If there are no cars in the image, no spot is occupied
+    if ious.shape[1] == 0:
+        best_car = np.full(ious.shape[0], -1, dtype=np.int64)
+        max_iou = np.zeros(ious.shape[0], dtype=np.float64)
+        return np.zeros(ious.shape[0], dtype=bool), best_car, max_iou
+
+    best_car = ious.argmax(axis=1)
+    max_iou = ious[np.arange(ious.shape[0]), best_car]
+
+    # A spot is occupied if the maximum IoU is above the threshold
+    return max_iou > threshold, best_car, max_iou
+
+# Registry of parking lot layouts, so the parking spots (class 1 and 2) of a lot/camera are loaded once
+class LayoutRegistry:
+    def __init__(self, layouts_folder: str, layout_pattern: str = '', max_layouts: int = 128):
+        # Each layout is a YOLO label file named after its key, only its parking spots are used
+        self.layouts_folder = layouts_folder
+        # Regex used to extract the layout key from the image file name (e.g. r'set\d+')
+        # Without a pattern every image has its own layout, named after the image
+        self.layout_pattern = re.compile(layout_pattern) if layout_pattern else None
+        # Number of layouts kept in memory, the least recently used ones are dropped (without a pattern,
+        # every image has its own layout, so the memory stays bounded however many images are processed)
+        self.max_layouts = max_layouts
+
+        self._layouts = OrderedDict() # key -> (N,5) normalized parking spots
+        self._pixel_layouts = OrderedDict() # (key, width, height) -> (class ids, pixel boxes)
+        self._lock = threading.Lock() # The service shares a registry between its request threads
+
+    # Get the layout key of an image
+    def key(self, image_file: str):
+        image_name = os.path.splitext(os.path.basename(image_file))[0]
+        if self.layout_pattern is not None:
+            match = self.layout_pattern.search(image_name)
+            if match:
+                return match.group(0)
+        return image_name
+
+    # Function to get a cached value and mark it as recently used, None if it is not cached
+    def _cached(self, cache, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    # Function to cache a value, dropping the least recently used ones above max_layouts
+    def _store(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_layouts:
+                cache.popitem(last=False)
+
+    # Get the parking spots of an image layout as an (N,5) array in YOLO format
+    def get(self, image_file: str):
+        key = self.key(image_file)
+        spots = self._cached(self._layouts, key)
+        if spots is None:
+            labels = load_labels(os.path.join(self.layouts_folder, key + '.txt'))
+            spots = labels[(labels[:, 0] == 1) | (labels[:, 0] == 2)]
+            self._store(self._layouts, key, spots)
+        return spots
+
+    # Get the class ids and pixel boxes of the parking spots of an image with the given size
+    def get_pixels(self, image_file: str, image_width: int, image_height: int):
+        pixel_key = (self.key(image_file), image_width, image_height)
+        pixels = self._cached(self._pixel_layouts, pixel_key)
+        if pixels is None:
+            spots = self.get(image_file)
+            pixels = (spots[:, 0], yolo_to_pixel_boxes(spots[:, 1:], image_width, image_height))
+            self._store(self._pixel_layouts, pixel_key, pixels)
+        return pixels
+
+# Function to check if a car is occupying a parking spot
+def is_occupied(image, annotations, left, top, right, bottom, threshold):
+    # Annotations can be the lines of a label file or an already parsed labels array
+    labels = annotations if isinstance(annotations, np.ndarray) else parse_labels(annotations)
+
+    # Get the car bounding boxes
+    car_boxes = yolo_to_pixel_boxes(labels[labels[:, 0] == 0, 1:], image.shape[1], image.shape[0])
+
+    occupied, _, _ = compute_occupancy([(left, top, right, bottom)], car_boxes, threshold)
+    return bool(occupied[0])
+
+# Function to count the parking spots and cars of an image, given which spots are occupied
+# Without cars (e.g. with a spot classifier), the car counts are unknown and set to None
+def occupancy_counts(class_ids, occupied, with_cars: bool = True):
+    cars = int(np.count_nonzero(class_ids == 0))
+    disabled_spots = int(np.count_nonzero(class_ids == 1))
+    spots = int(np.count_nonzero(class_ids == 2))
+    occupied_disabled_spot = int(np.count_nonzero(occupied & (class_ids == 1)))
+    occupied_spot = int(np.count_nonzero(occupied & (class_ids == 2)))
+
+    return {
+        'Disabled parking spots': disabled_spots,
+        'Parking spots': spots,
+        'Cars': cars if with_cars else None,
+        # Empty parking spots count
+        'Empty disabled parking spots': disabled_spots - occupied_disabled_spot,
+        'Occupied disabled parking spots': occupied_disabled_spot,
+        'Empty parking spots': spots - occupied_spot,
+        'Occupied parking spots': occupied_spot,
+        # Calculate the total number of cars in transit or parked in non-parking spots
+        'Cars in transit or parked in non-parking spots': cars - occupied_disabled_spot - occupied_spot if with_cars else None
+    }
+
+# Function to count the parking spots and cars of an image and check which spots are occupied
+def analyze_occupancy(class_ids, pixel_boxes, threshold):
+    # Check which parking spots (disabled or not) are occupied by a car
+    spot_mask = (class_ids == 1) | (class_ids == 2)
+    occupied = np.zeros(len(class_ids), dtype=bool)
+    occupied[spot_mask], _, _ = compute_occupancy(pixel_boxes[spot_mask], pixel_boxes[class_ids == 0], threshold)
+
+    return occupancy_counts(class_ids, occupied), occupied
@@ -0,0 +1,75 @@
+# utils/loadgen.py
+
+# Load generator for the occupancy service (service.py): concurrent cameras uploading images
+
+import numpy as np
+import os
+import json
+import time
+import argparse
+import urllib.request
+import urllib.error
+import urllib.parse
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Function to send one image to the service, returns the latency in seconds and whether it succeeded
+def post_image(url: str, image_bytes: bytes, lot: str):
+    request = urllib.request.Request(f'{url}/occupancy?{urllib.parse.urlencode({"lot": lot})}', data=image_bytes, method='POST', headers={'Content-Type': 'application/octet-stream'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            success = response.status == 200
+    except (urllib.error.URLError, ConnectionError):
+        success = False
+    return time.perf_counter() - start, success
+
+# Function to send requests images (cycling over the images) with concurrency parallel clients
+# Returns the client side latency percentiles and throughput, and the service metrics
+def run_load(url: str, images, lot: str, requests: int = 100, concurrency: int = 8):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda i: post_image(url, images[i % len(images)], lot), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    with urllib.request.urlopen(f'{url}/metrics') as response:
+        metrics = json.loads(response.read())
+
+    return {
+        'Requests': requests,
+        'Concurrency': concurrency,
+        'Errors': sum(not success for _, success in results),
+        'Throughput (req/s)': requests / elapsed,
+        'Latency p50 (ms)': float(np.percentile(latencies, 50)),
+        'Latency p99 (ms)': float(np.percentile(latencies, 99)),
+        'Service': metrics
+    }
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='service url')
+    parser.add_argument('--images', type=str, required=True, help='folder with the images to upload')
+    parser.add_argument('--lot', type=str, required=True, help='lot id of the images')
+    parser.add_argument('--requests', type=int, default=100, help='total number of requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of parallel clients')
+    opt = parser.parse_args()
+    return opt
+
+def main(opt):
+    images = []
+    for entry in sorted(os.scandir(opt.images), key=lambda entry: entry.name):
+        if entry.is_file():
+            with open(entry.path, 'rb') as f:
+                images.append(f.read())
+
+    report = run_load(opt.url.rstrip('/'), images, opt.lot, opt.requests, opt.concurrency)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,1029 @@
+# utils/occupancy.py
+
+# pylint: disable=unsubscriptable-object
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import numpy as np
+import cv2
+import os
+import sys
+import io
+import csv
+import json
+import struct
+import threading
+import time
+import contextlib
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from utils.geometry import cache_folder, list_files, write_atomic, load_labels, yolo_to_pixel_boxes, LayoutRegistry, occupancy_counts, analyze_occupancy
+    from utils.model_resolution import model_labels_folder
+    from utils.detection_cache import file_hash, detector_key
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from geometry import cache_folder, list_files, write_atomic, load_labels, yolo_to_pixel_boxes, LayoutRegistry, occupancy_counts, analyze_occupancy
+    from model_resolution import model_labels_folder
+    from detection_cache import file_hash, detector_key
+
+
+# Function to get the peak resident memory (RSS) of the current process, in MB
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+## Instrumentation ##
+# process_images can time each stage of the work on each image when given a ProcessingStats.
+# Without stats, every stage timer is a shared no-op context manager, so the cost is negligible.
+
+# Histogram bin edges of the per-image latencies, in milliseconds
+LATENCY_BINS_MS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+# Stats of a process_images run: wall and CPU time of each stage, per-image latencies, counters and peak RSS
+# hook (optional) is called with (kind, name, value) for every measure, kind being 'stage', 'counter' or 'latency',
+# to forward the measures to another metrics system
+class ProcessingStats:
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.stages = {} # name: [wall seconds, CPU seconds, calls]
+        self.counters = {'Images': 0, 'Failed images': 0, 'Spots': 0, 'Cars': 0, 'Bytes read': 0, 'Bytes written': 0}
+        self.latencies = []
+        self.wall_time = 0.0
+        self.peak_rss_mb = 0.0
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, wall: float, cpu: float, calls: int = 1):
+        with self._lock:
+            stage = self.stages.setdefault(name, [0.0, 0.0, 0])
+            stage[0] += wall
+            stage[1] += cpu
+            stage[2] += calls
+        if self.hook is not None:
+            self.hook('stage', name, wall)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self.hook is not None:
+            self.hook('counter', name, value)
+
+    # Function to record a processed image: its latency in seconds, and its spots and cars from the class ids
+    def add_image(self, image_file: str, latency: float, class_ids=None):
+        with self._lock:
+            self.latencies.append(latency)
+        self.count('Images')
+        if class_ids is not None:
+            self.count('Spots', int(np.count_nonzero((class_ids == 1) | (class_ids == 2))))
+            self.count('Cars', int(np.count_nonzero(class_ids == 0)))
+        if self.hook is not None:
+            self.hook('latency', image_file, latency)
+
+    # Function to get the picklable state of the stats, to send the stats of a worker process to the main one
+    def state(self):
+        with self._lock:
+            return {'stages': dict(self.stages), 'counters': dict(self.counters), 'latencies': list(self.latencies), 'peak_rss_mb': peak_rss_mb()}
+
+    def merge(self, state):
+        for name, (wall, cpu, calls) in state['stages'].items():
+            self.add_stage(name, wall, cpu, calls)
+        for name, value in state['counters'].items():
+            if value:
+                self.count(name, value)
+        with self._lock:
+            self.latencies.extend(state['latencies'])
+            self.peak_rss_mb = max(self.peak_rss_mb, state['peak_rss_mb'])
+
+    def to_dict(self):
+        latencies = np.array(self.latencies, dtype=np.float64) * 1000
+        return {
+            'Wall time (s)': self.wall_time,
+            'Peak RSS (MB)': self.peak_rss_mb,
+            'Counters': dict(self.counters),
+            'Stages': {name: {'Wall (s)': wall, 'CPU (s)': cpu, 'Calls': calls} for name, (wall, cpu, calls) in self.stages.items()},
+            'Latency (ms)': {
+                'Mean': float(latencies.mean()) if len(latencies) else None,
+                'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p90': float(np.percentile(latencies, 90)) if len(latencies) else None,
+                'p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'Max': float(latencies.max()) if len(latencies) else None
+            },
+            'Latency histogram (ms)': {
+                'Bins': [str(edge) for edge in LATENCY_BINS_MS],
+                'Counts': np.histogram(latencies, LATENCY_BINS_MS)[0].tolist()
+            }
+        }
+
+    # Function to save the stats as JSON, or as a flat 'Metric,Value' CSV when the path ends with .csv
+    def save(self, path: str):
+        stats = self.to_dict()
+        if not path.endswith('.csv'):
+            write_atomic(path, json.dumps(stats, indent=4).encode())
+            return
+
+        rows = [('Wall time (s)', stats['Wall time (s)']), ('Peak RSS (MB)', stats['Peak RSS (MB)'])]
+        rows += [(name, value) for name, value in stats['Counters'].items()]
+        for name, stage in stats['Stages'].items():
+            rows += [(f'{name} {measure}', value) for measure, value in stage.items()]
+        rows += [(f'Latency {measure} (ms)', value) for measure, value in stats['Latency (ms)'].items()]
+        rows += [(f'Latency < {edge} ms', count) for edge, count in zip(LATENCY_BINS_MS[1:], stats['Latency histogram (ms)']['Counts'])]
+
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(['Metric', 'Value'])
+        writer.writerows(rows)
+        write_atomic(path, output.getvalue().encode())
+
+# Timer of one stage, adds its wall time and the CPU time of its thread to the stats when it exits
+class _StageTimer:
+    __slots__ = ('stats', 'name', 'wall', 'cpu')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_stage(self.name, time.perf_counter() - self.wall, time.thread_time() - self.cpu)
+        return False
+
+_NO_TIMER = contextlib.nullcontext()
+
+# Function to time a stage with a with statement, does nothing when stats is None
+def stage_timer(stats, name: str):
+    return _NO_TIMER if stats is None else _StageTimer(stats, name)
+
+# Function to get the size of a file, 0 if it can't be read
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+# Function to read an image, counting the decoding in the stats (if any)
+def read_image(image_path: str, stats=None):
+    with stage_timer(stats, 'decode'):
+        image = cv2.imread(image_path)
+    if stats is not None:
+        stats.count('Bytes read', _file_size(image_path))
+    return image
+
+# Function to save an image atomically, returns the number of bytes written
+def write_image(image_path: str, image, stats=None):
+    with stage_timer(stats, 'encode'):
+        success, buffer = cv2.imencode(os.path.splitext(image_path)[1], image)
+    if not success:
+        raise ValueError(f'Could not encode image {image_path}')
+    with stage_timer(stats, 'write'):
+        write_atomic(image_path, buffer.tobytes())
+    if stats is not None:
+        stats.count('Bytes written', buffer.nbytes)
+    return buffer.nbytes
+
+# JPEG start of frame markers, they hold the image size (0xC4, 0xC8 and 0xCC are not frames)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Function to read the EXIF orientation from the payload of a JPEG APP1 segment
+def _exif_orientation(segment: bytes):
+    if not segment.startswith(b'Exif\x00\x00'):
+        return 1
+    tiff = segment[6:]
+    byte_order = '<' if tiff[:2] == b'II' else '>'
+    try:
+        ifd_offset = struct.unpack(byte_order + 'I', tiff[4:8])[0]
+        entries = struct.unpack(byte_order + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+        for i in range(entries):
+            entry = tiff[ifd_offset + 2 + 12 * i:ifd_offset + 14 + 12 * i]
+            tag, _, _, value = struct.unpack(byte_order + 'HHIH', entry[:10])
+            if tag == 0x0112:
+                return value
+    except struct.error: # Truncated EXIF
+        pass
+    return 1
+
+# Function to read the (width, height) of a JPEG from its header, as cv2.imread would decode it
+def _probe_jpeg_size(f):
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff': # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+
+        # Markers without payload
+        if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            # cv2.imread applies the EXIF orientation, orientations 5 to 8 swap width and height
+            return (height, width) if orientation >= 5 else (width, height)
+        if marker == 0xE1: # APP1, may hold the EXIF orientation
+            orientation = _exif_orientation(f.read(length - 2))
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+# Function to get the image (width, height) reading only its header, without decoding its pixels
+def probe_image_size(image_path: str):
+    with open(image_path, 'rb') as f:
+        header = f.read(24)
+        if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+            return struct.unpack('>II', header[16:24])
+        if header.startswith(b'\xff\xd8'):
+            f.seek(2)
+            size = _probe_jpeg_size(f)
+            if size is not None:
+                return size
+
+    # Other formats: PIL only reads the header until the pixels are accessed
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        return image.size
+
+# Persistent cache of the image sizes of a folder, keyed by file name, size and modification time
+# The cache is kept in the cache folder of the images folder (see CACHE_DIR), never in the images folder itself
+class ImageSizeCache:
+    def __init__(self, images_folder: str, cache_dir: str = ''):
+        self.images_folder = images_folder
+        self.cache_path = os.path.join(cache_folder('sizes', images_folder, cache_dir), 'sizes.json')
+        self._dirty = False
+        try:
+            with open(self.cache_path, 'r') as f:
+                self._sizes = json.load(f)
+        except (OSError, ValueError): # Missing or corrupted cache
+            self._sizes = {}
+
+    # Get the (width, height) of an image of the folder
+    def get(self, image_file: str):
+        stat = os.stat(os.path.join(self.images_folder, image_file))
+        entry = self._sizes.get(image_file)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2], entry[3]
+
+        width, height = probe_image_size(os.path.join(self.images_folder, image_file))
+        self._sizes[image_file] = [stat.st_mtime_ns, stat.st_size, width, height]
+        self._dirty = True
+        return width, height
+
+    # Save the cache, if anything changed
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            write_atomic(self.cache_path, json.dumps(self._sizes).encode())
+            self._dirty = False
+        except OSError: # Read-only cache folder, keep working without cache
+            pass
+
+# Function to darken a rectangle of the image, blending only the pixels inside it
+def shade_rectangle(image, left, top, right, bottom, alpha):
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, image.shape[1] - 1), min(bottom, image.shape[0] - 1)
+    if right < left or bottom < top:
+        return
+
+    roi = image[top:bottom + 1, left:right + 1]
+    cv2.addWeighted(np.zeros_like(roi), alpha, roi, 1 - alpha, 0, dst=roi)
+
+# Function to draw the parking spots, the cars and the legends on the image
+def render_occupancy(image, class_ids, pixel_boxes, occupied, counts, highlighted_cars):
+    # Set the color based on the class ID
+    colors = np.zeros((len(class_ids), 3), dtype=np.int64)
+    colors[class_ids == 0] = (0, 165, 255)  # Car: orange color
+    colors[class_ids == 1] = (255, 0, 0)  # Disabled parking spot: blue color
+    colors[class_ids == 2] = (0, 255, 0)  # Parking spot: green color
+    colors[occupied] = (0, 0, 255)  # Occupied parking spot: red color
+
+    draw_mask = np.ones(len(class_ids), dtype=bool)
+    if not highlighted_cars:
+        draw_mask[class_ids == 0] = False
+
+    # Sort the rectangles so that red rectangles are processed last
+    order = np.concatenate([np.flatnonzero(draw_mask & ~occupied), np.flatnonzero(draw_mask & occupied)])
+
+    # Draw the bounding box rectangles on the image, one call per run of rectangles with the same color
+    corners = pixel_boxes[order][:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2).astype(np.int32)
+    colors = colors[order]
+    start = 0
+    for end in range(1, len(order) + 1):
+        if end == len(order) or (colors[end] != colors[start]).any():
+            cv2.polylines(image, list(corners[start:end]), True, tuple(colors[start].tolist()), 2)
+            start = end
+
+    alpha = 0.4  # Transparency factor.
+    
+    # Image legend
+    text_position = (image.shape[1] - 350, 30)  # Top-right corner position
+    shade_rectangle(image, text_position[0] - 10, text_position[1] - 30, text_position[0] + 320, text_position[1] + 80, alpha)
+    
+    text = f'Disabled parking spots: {counts["Disabled parking spots"]}'
+    cv2.putText(image, text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+    text_position = (text_position[0], text_position[1] + 30)  # Increment the y-coordinate
+    
+    text = f'Parking spots: {counts["Parking spots"]}'
+    cv2.putText(image, text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+    text_position = (text_position[0], text_position[1] + 30)  # Increment the y-coordinate
+
+    # The car counts are unknown (None) with a spot classifier
+    if counts['Cars'] is not None:
+        text = f'Cars: {counts["Cars"]}'
+        cv2.putText(image, text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+    
+    text_position = (30, 30)  # Top-left corner position
+    shade_rectangle(image, text_position[0] - 10, text_position[1] - 30, text_position[0] + 585, text_position[1] + 140, alpha)
+
+    for column in ['Empty disabled parking spots', 'Occupied disabled parking spots', 'Empty parking spots', 'Occupied parking spots', 'Cars in transit or parked in non-parking spots']:
+        if counts[column] is None:
+            continue
+        text = f'{column}: {counts[column]}'
+        cv2.putText(image, text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        text_position = (text_position[0], text_position[1] + 30)  # Increment the y-coordinate
+
+    return image
+
+# Function to get the class ids and pixel boxes of the parking spots and cars of an image
+# If a layout registry is given, the parking spots come from it and only the cars are read from the annotation file
+def get_image_boxes(image_path, annotation_path, image_width, image_height, layouts=None):
+    # Read the annotation file, unless the labels are already in memory
+    if layouts is None:
+        boxes = annotation_path if isinstance(annotation_path, np.ndarray) else load_labels(annotation_path)
+        class_ids = boxes[:, 0]
+
+        # Calculate the bounding box coordinates of all annotations at once
+        pixel_boxes = yolo_to_pixel_boxes(boxes[:, 1:], image_width, image_height)
+    else:
+        # An image without detections has no annotation file
+        try:
+            cars = annotation_path if isinstance(annotation_path, np.ndarray) else load_labels(annotation_path)
+        except FileNotFoundError:
+            cars = np.empty((0, 5), dtype=np.float64)
+        cars = cars[cars[:, 0] == 0]
+
+        # The parking spots are already in pixel coordinates, only the cars need to be converted
+        spot_class_ids, spot_boxes = layouts.get_pixels(image_path, image_width, image_height)
+        class_ids = np.concatenate([spot_class_ids, cars[:, 0]])
+        pixel_boxes = np.concatenate([spot_boxes, yolo_to_pixel_boxes(cars[:, 1:], image_width, image_height)])
+
+    return class_ids, pixel_boxes
+
+# Function to draw bounding boxes on the image
+# If a layout registry is given, the parking spots come from it and only the cars are read from the annotation file
+# If render is False, only the occupancy is analyzed: the image pixels are never decoded and no image is written,
+# the image (width, height) can be given in image_size, otherwise it is read from the image header
+# An already decoded image can be given in image, then it is not read again
+# If stats (ProcessingStats) is given, the time of each stage and the image counters are added to it
+def draw_bounding_boxes(image_path, annotation_path, output_path, threshold, highlighted_cars, layouts=None, render=True, image_size=None, image=None, stats=None):
+    start = time.perf_counter() if stats is not None else 0.0
+
+    # Load the image
+    if image is not None:
+        image_height, image_width = image.shape[:2]
+    elif render:
+        image = read_image(image_path, stats)
+        if image is None:
+            raise ValueError(f'Could not read image {image_path}')
+        image_height, image_width = image.shape[:2]
+    elif image_size is not None:
+        image_width, image_height = image_size
+    else:
+        image_width, image_height = probe_image_size(image_path)
+    
+    with stage_timer(stats, 'labels'):
+        class_ids, pixel_boxes = get_image_boxes(image_path, annotation_path, image_width, image_height, layouts)
+
+    with stage_timer(stats, 'occupancy'):
+        counts, occupied = analyze_occupancy(class_ids, pixel_boxes, threshold)
+
+    if render:
+        with stage_timer(stats, 'render'):
+            image = render_occupancy(image, class_ids, pixel_boxes, occupied, counts, highlighted_cars)
+
+        # Save the image with bounding boxes
+        output_image_path = os.path.join(output_path, os.path.basename(image_path))
+        write_image(output_image_path, image, stats)
+
+    # Create a record to store the results
+    results = {'Image File': os.path.basename(image_path)}
+    results.update(counts)
+
+    if stats is not None:
+        if isinstance(annotation_path, str):
+            stats.count('Bytes read', _file_size(annotation_path))
+        stats.add_image(results['Image File'], time.perf_counter() - start, class_ids)
+        
+    return results
+
+
+## Result sinks ##
+# process_images streams the record of each image to one or more sinks as soon as it is ready.
+# A sink only needs a write(record) and a close() method.
+
+# Sink that keeps the results in memory as a DataFrame, for notebook use
+class DataFrameSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame.from_records(self.records)
+
+# Sink that writes the results to a CSV file incrementally
+# Rows are flushed to '<path>.<pid>.partial' while the run goes, so a crash keeps every row written so far,
+# and the file is renamed to path when the run finishes
+class CsvSink:
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.partial_path = f'{path}.{os.getpid()}.partial'
+        self.flush_every = flush_every
+        self._file = None
+        self._writer = None
+        self._pending = 0
+
+    def write(self, record):
+        if self._writer is None:
+            self._file = open(self.partial_path, 'w', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=list(record), lineterminator='\n')
+            self._writer.writeheader()
+
+        self._writer.writerow(record)
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self._file.flush()
+            self._pending = 0
+
+    def close(self):
+        if self._file is None: # No results, write an empty file
+            self._file = open(self.partial_path, 'w', newline='')
+            self._file.write('\n')
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+
+# Sink that writes the results to a Parquet file, one row group per chunk of records
+# Needs the optional pyarrow dependency
+class ParquetSink:
+    def __init__(self, path: str, chunk_size: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError('ParquetSink needs pyarrow, install it with: pip install pyarrow') from e
+
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self.partial_path = f'{path}.{os.getpid()}.partial'
+        self.chunk_size = chunk_size
+        self._records = []
+        self._writer = None
+
+    def _write_chunk(self):
+        table = self._pa.Table.from_pylist(self._records)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.partial_path, table.schema)
+        self._writer.write_table(table)
+        self._records = []
+
+    def write(self, record):
+        self._records.append(record)
+        if len(self._records) >= self.chunk_size:
+            self._write_chunk()
+
+    def close(self):
+        if self._records:
+            self._write_chunk()
+        if self._writer is None: # No results, nothing to write
+            return
+        self._writer.close()
+        os.replace(self.partial_path, self.path)
+
+
+## Incremental runs ##
+# With incremental=True, process_images keeps a run manifest in the output folder with a fingerprint of each
+# processed image (size, modification time and the hash of its label/layout files) and the run settings
+# (threshold, model, layouts, ...). The next run only processes the new and changed images, reuses the rows of
+# output.csv for the others and drops the rows of the deleted images.
+
+RUN_MANIFEST_FILE = 'output_manifest.json'
+
+# Run manifest of an output folder, a changed config invalidates every image
+class RunManifest:
+    def __init__(self, output_folder: str, config):
+        self.path = os.path.join(output_folder, RUN_MANIFEST_FILE)
+        self.config = config
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError): # First run or corrupted manifest
+            manifest = {}
+
+        self.previous_images = manifest.get('images', {}) if manifest.get('config') == config else {}
+        self.deleted = [] # Filled by changed()
+        self._files = manifest.get('files', {}) # Label/layout file -> [size, mtime_ns, hash]
+        self._used_files = {}
+        self.images = {}
+
+    # Get the hash of a label/layout file, only rehashed if its size or mtime changed ('' if it doesn't exist)
+    def _file_hash(self, path: str):
+        if path in self._used_files:
+            return self._used_files[path][2]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ''
+        entry = self._files.get(path)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            entry = [stat.st_size, stat.st_mtime_ns, file_hash(path)]
+        self._used_files[path] = entry
+        return entry[2]
+
+    # Function to get the images to process among image_files: the new ones and the ones whose file or labels changed
+    # dependencies(image_file) gives the label/layout files the results of an image depend on
+    def changed(self, images_folder: str, image_files, dependencies):
+        changed = []
+        for image_file in image_files:
+            stat = os.stat(os.path.join(images_folder, image_file))
+            entry = [stat.st_size, stat.st_mtime_ns, '/'.join(self._file_hash(path) for path in dependencies(image_file))]
+            if self.previous_images.get(image_file) != entry:
+                changed.append(image_file)
+            self.images[image_file] = entry
+
+        self.deleted = sorted(set(self.previous_images) - set(image_files))
+        return changed
+
+    # Function to save the manifest, with the images whose results are in the output
+    def save(self, done_images):
+        manifest = {
+            'config': self.config,
+            'images': {image_file: self.images[image_file] for image_file in done_images},
+            'files': self._used_files
+        }
+        write_atomic(self.path, json.dumps(manifest).encode())
+
+# Function to convert a value of output.csv back to the type of the results (int, float, None or str)
+def _parse_csv_value(value: str):
+    if value == '':
+        return None
+    for number_type in (int, float):
+        try:
+            return number_type(value)
+        except ValueError:
+            pass
+    return value
+
+# Function to read the rows of a previous output.csv, as {image file: results}, empty if there is none
+def read_output_csv(path: str):
+    try:
+        with open(path, 'r', newline='') as f:
+            return {row['Image File']: {key: value if key == 'Image File' else _parse_csv_value(value) for key, value in row.items()} for row in csv.DictReader(f)}
+    except (OSError, KeyError, csv.Error): # Missing or corrupted output
+        return {}
+
+# Generator merging the reused results with the (image file, results, error) outcomes of the processed images,
+# both sorted by image file, so the output has the same order as a full run
+def _merge_results(reused, outcomes):
+    reused = iter(sorted(reused.items()))
+    next_reused = next(reused, None)
+    for image_file, results, error in outcomes:
+        while next_reused is not None and next_reused[0] < image_file:
+            yield next_reused[0], next_reused[1], None
+            next_reused = next(reused, None)
+        yield image_file, results, error
+    while next_reused is not None:
+        yield next_reused[0], next_reused[1], None
+        next_reused = next(reused, None)
+
+
+# Generator processing the images one after another in the current process, yields (image file, results, error)
+def _serial_results(tasks, output_images_folder, threshold, highlighted_cars, layouts, render, stats=None):
+    for image_path, annotation_path, size in tasks:
+        try:
+            # Call the function to draw bounding boxes and save the resulting image
+            yield os.path.basename(image_path), draw_bounding_boxes(image_path, annotation_path, output_images_folder, threshold, highlighted_cars, layouts, render, size, stats=stats), None
+        except Exception as e:
+            yield os.path.basename(image_path), None, e
+
+
+# Layout registry of each process_images worker process, loaded once per process
+_worker_layouts = None
+
+def _init_worker(layouts_folder, layout_pattern):
+    global _worker_layouts
+    cv2.setNumThreads(1) # One image per core, avoid oversubscribing the CPU
+    _worker_layouts = LayoutRegistry(layouts_folder, layout_pattern)
+
+# With instrument, the stats of the image are measured in the worker and sent back with the results
+def _process_image(image_path, annotation_path, output_images_folder, threshold, highlighted_cars, render, image_size, instrument):
+    stats = ProcessingStats() if instrument else None
+    results = draw_bounding_boxes(image_path, annotation_path, output_images_folder, threshold, highlighted_cars, _worker_layouts, render, image_size, stats=stats)
+    return results, stats.state() if instrument else None
+
+# Generator processing the images in a pool of processes, yields (image file, results, error) sorted like the tasks
+def _pool_results(tasks, output_images_folder, threshold, highlighted_cars, layouts_folder, layout_pattern, render, workers, stats=None):
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(layouts_folder, layout_pattern)) as executor:
+        futures = [executor.submit(_process_image, image_path, annotation_path, output_images_folder, threshold, highlighted_cars, render, size, stats is not None) for image_path, annotation_path, size in tasks]
+
+        # Collect the results in the submission order, so they stay sorted by file name
+        for (image_path, _, _), future in zip(tasks, futures):
+            try:
+                results, image_stats = future.result()
+                if image_stats is not None:
+                    stats.merge(image_stats)
+                yield os.path.basename(image_path), results, None
+            except Exception as e:
+                yield os.path.basename(image_path), None, e
+
+
+# Generator processing and rendering the images in a pipeline, yields (image file, results, error) sorted like the tasks
+# read_threads decode the next queue_size images while the current one is processed (cv2 releases the GIL),
+# write_threads encode and write up to queue_size rendered images in the background. Both queues are bounded,
+# so at most about 2 * queue_size images are in memory. A stage with 0 threads runs in the current thread.
+# With stats, the latency of an image ends when its write is queued
+def _pipeline_results(tasks, output_images_folder, threshold, highlighted_cars, layouts, read_threads, write_threads, queue_size, stats=None):
+    readers = ThreadPoolExecutor(max_workers=read_threads) if read_threads > 0 else None
+    writers = ThreadPoolExecutor(max_workers=write_threads) if write_threads > 0 else None
+    queue_size = max(queue_size, 1)
+
+    pending_tasks = iter(tasks)
+    reads = deque() # (task, decoded image future)
+    writes = deque() # (image file, results, written image future or error)
+
+    def prefetch():
+        task = next(pending_tasks, None)
+        if task is not None:
+            reads.append((task, readers.submit(read_image, task[0], stats) if readers is not None else None))
+
+    def finish(image_file, results, write):
+        if isinstance(write, Exception):
+            return image_file, None, write
+        try:
+            if write is not None:
+                write.result()
+            return image_file, results, None
+        except Exception as e:
+            return image_file, None, e
+
+    try:
+        for _ in range(queue_size):
+            prefetch()
+
+        while reads:
+            (image_path, annotation_path, _), read = reads.popleft()
+            prefetch()
+            image_file = os.path.basename(image_path)
+            start = time.perf_counter() if stats is not None else 0.0
+
+            try:
+                # Load the image
+                image = read.result() if read is not None else read_image(image_path, stats)
+                if image is None:
+                    raise ValueError(f'Could not read image {image_path}')
+
+                with stage_timer(stats, 'labels'):
+                    class_ids, pixel_boxes = get_image_boxes(image_path, annotation_path, image.shape[1], image.shape[0], layouts)
+                with stage_timer(stats, 'occupancy'):
+                    counts, occupied = analyze_occupancy(class_ids, pixel_boxes, threshold)
+                with stage_timer(stats, 'render'):
+                    image = render_occupancy(image, class_ids, pixel_boxes, occupied, counts, highlighted_cars)
+
+                # Save the image with bounding boxes
+                output_image_path = os.path.join(output_images_folder, image_file)
+                if writers is not None:
+                    write = writers.submit(write_image, output_image_path, image, stats)
+                else:
+                    write_image(output_image_path, image, stats)
+                    write = None
+
+                results = {'Image File': image_file}
+                results.update(counts)
+                writes.append((image_file, results, write))
+                if stats is not None:
+                    stats.count('Bytes read', _file_size(annotation_path))
+                    stats.add_image(image_file, time.perf_counter() - start, class_ids)
+            except Exception as e:
+                writes.append((image_file, None, e))
+
+            # Wait for the oldest writes when the write-behind queue is full
+            while len(writes) > queue_size:
+                yield finish(*writes.popleft())
+
+        while writes:
+            yield finish(*writes.popleft())
+    finally:
+        for executor in (readers, writers):
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Generator detecting the cars with an in-process detector (see utils/detector.py), yields (image file, results, error)
+# The images are decoded and detected in batches of detector.batch_size, the cars go to the occupancy step in memory
+# With stats, the batched detection is only measured in the 'detect' stage, not in the latency of each image
+# With a CachedDetector (see utils/detection_cache.py), the images are looked up by the hash of their file first:
+# the cached images skip the inference, and are not even decoded when render is False
+def _detector_results(tasks, output_images_folder, threshold, highlighted_cars, layouts, render, detector, stats=None):
+    cached = getattr(detector, 'cached', None)
+    for start in range(0, len(tasks), detector.batch_size):
+        batch_tasks = tasks[start:start + detector.batch_size]
+        if cached is not None:
+            try:
+                with stage_timer(stats, 'hash'):
+                    hashes = [file_hash(image_path) for image_path, _, _ in batch_tasks]
+                    batch_cars = cached(hashes)
+            except OSError as e:
+                for image_path, _, _ in batch_tasks:
+                    yield os.path.basename(image_path), None, e
+                continue
+            if stats is not None:
+                stats.count('Detection cache hits', sum(cars is not None for cars in batch_cars))
+                stats.count('Detection cache misses', sum(cars is None for cars in batch_cars))
+        else:
+            hashes = batch_cars = [None] * len(batch_tasks)
+
+        batch = []
+        for (image_path, _, _), content_hash, image_cars in zip(batch_tasks, hashes, batch_cars):
+            if image_cars is not None and not render:
+                batch.append((image_path, content_hash, None, image_cars))
+                continue
+            image = read_image(image_path, stats)
+            if image is None:
+                yield os.path.basename(image_path), None, ValueError(f'Could not read image {image_path}')
+                continue
+            batch.append((image_path, content_hash, image, image_cars))
+
+        # Detect the cars of the images that are not cached
+        missing = [item for item in batch if item[3] is None]
+        try:
+            if missing:
+                with stage_timer(stats, 'detect'):
+                    if cached is not None:
+                        cars = detector.predict_missing([image for _, _, image, _ in missing], [content_hash for _, content_hash, _, _ in missing])
+                    else:
+                        cars = detector.predict([image for _, _, image, _ in missing])
+                detected = {image_path: image_cars for (image_path, _, _, _), image_cars in zip(missing, cars)}
+            else:
+                detected = {}
+        except Exception as e:
+            for image_path, _, _, image_cars in batch:
+                if image_cars is None:
+                    yield os.path.basename(image_path), None, e
+            batch = [item for item in batch if item[3] is not None]
+            detected = {}
+
+        for image_path, _, image, image_cars in batch:
+            try:
+                image_cars = detected[image_path] if image_cars is None else image_cars
+                yield os.path.basename(image_path), draw_bounding_boxes(image_path, image_cars, output_images_folder, threshold, highlighted_cars, layouts, render, image=image, stats=stats), None
+            except Exception as e:
+                yield os.path.basename(image_path), None, e
+
+
+# Generator checking the parking spots with a spot classifier (see utils/spot_classifier.py), yields (image file, results, error)
+# Only the crops of the parking spots are classified, no car is detected
+def _classifier_results(tasks, output_images_folder, highlighted_cars, layouts, render, classifier, stats=None):
+    for image_path, _, _ in tasks:
+        image_file = os.path.basename(image_path)
+        start = time.perf_counter() if stats is not None else 0.0
+        try:
+            # Load the image
+            image = read_image(image_path, stats)
+            if image is None:
+                raise ValueError(f'Could not read image {image_path}')
+
+            with stage_timer(stats, 'labels'):
+                class_ids, spot_boxes = layouts.get_pixels(image_path, image.shape[1], image.shape[0])
+            with stage_timer(stats, 'classify'):
+                occupied, _ = classifier.predict(image, spot_boxes)
+            counts = occupancy_counts(class_ids, occupied, with_cars=False)
+
+            if render:
+                with stage_timer(stats, 'render'):
+                    image = render_occupancy(image, class_ids, spot_boxes, occupied, counts, highlighted_cars)
+                # Save the image with bounding boxes
+                write_image(os.path.join(output_images_folder, image_file), image, stats)
+
+            results = {'Image File': image_file}
+            results.update(counts)
+            if stats is not None:
+                stats.add_image(image_file, time.perf_counter() - start, class_ids)
+            yield image_file, results, None
+        except Exception as e:
+            yield image_file, None, e
+
+
+# Function to get the settings of a run that change its results, saved in the run manifest
+def _run_config(threshold, highlighted_cars, labels_folder, layouts_folder, layout_pattern, render, detector, spot_classifier):
+    if detector is not None:
+        backend = 'detector:' + detector_key(detector)
+    elif spot_classifier is not None:
+        backend = 'spot classifier:' + spot_classifier.fingerprint()
+    else:
+        backend = 'labels:' + os.path.abspath(labels_folder)
+    return {
+        'Threshold': threshold,
+        'Highlighted cars': highlighted_cars,
+        'Render': render,
+        'Model': backend,
+        'Layouts': os.path.abspath(layouts_folder),
+        'Layout pattern': layout_pattern
+    }
+
+
+# Function to process all images in a folder
+# workers is the number of processes used to process the images (0 = all cores, 1 = no process pool)
+# sinks receive the results of each image as they are ready (default: output.csv and an in-memory DataFrame),
+# the returned DataFrame comes from the first DataFrameSink, if any
+# If render is False, only the occupancy is analyzed and no annotated image is written
+# When rendering with workers = 1, read_threads and write_threads enable a pipeline that decodes the next images
+# and writes the rendered ones in background threads, with queue_size images at most in each queue
+# If a detector (utils.detector.Detector) is given, the cars are detected in this process instead of read from model labels
+# If a spot_classifier (utils.spot_classifier.SpotClassifier) is given, the parking spot crops are classified instead,
+# and the car counts are left empty
+# If stats (ProcessingStats) is given, it is filled with the stage timers, latencies and counters of the run,
+# stats_sidecar ('json' or 'csv') also saves them to output_stats.<format> next to output.csv
+# If incremental is True, only the images that are new or changed since the last incremental run with the same settings
+# are processed, the results of the others are reused from output.csv (see RunManifest)
+def process_images(data_path: str, output_folder: str, threshold: float = 0.4, highlighted_cars: bool = True, model: str = '', layouts_folder: str = '', layout_pattern: str = '', workers: int = 0, sinks=None, render: bool = True, read_threads: int = 0, write_threads: int = 0, queue_size: int = 8, detector=None, spot_classifier=None, stats=None, stats_sidecar: str = '', incremental: bool = False):
+    processed_images = 0
+    if stats is None and stats_sidecar:
+        stats = ProcessingStats()
+    run_start = time.perf_counter()
+
+    images_folder = os.path.join(data_path, 'images/')
+
+    # The parking spots of each lot/camera are loaded once from the layouts folder (by default, the ground truth labels)
+    if layouts_folder == '':
+        layouts_folder = os.path.join(data_path, 'labels/')
+    
+    # Check if the model name is provided
+    if spot_classifier is not None:
+        labels_folder = ''
+        print('Using spot classifier')
+    elif detector is not None:
+        labels_folder = ''
+        print(f'Using detector {detector.model}')
+    elif model != '':
+        labels_folder = model_labels_folder(model)
+
+        if not os.path.isdir(labels_folder): # if labels not found
+            print(
+                f'No labels found for model {model}!\n' +
+                'Make sure you wrote the correct model name. Otherwise, train the model first.')
+            import pandas as pd
+
+            return pd.DataFrame()
+        print(f'Using labels from {labels_folder}')
+    
+    else:
+        labels_folder = os.path.join(data_path, 'labels/')
+
+    # Create the output folder if it doesn't exist (it can be empty when nothing is written to it)
+    if output_folder != '' and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    output_images_folder = os.path.join(output_folder, 'images/')
+    # Create the output images folder if it doesn't exist
+    if render and not os.path.exists(os.path.join(output_folder, 'images/')):
+        os.makedirs(os.path.join(output_folder, 'images/'))
+
+    # Sort the images so the results don't depend on the os.listdir order (skip folders and hidden files)
+    image_files = list_files(images_folder)
+
+    # Only process the new and changed images, the results of the others come from the previous output.csv
+    reused = {}
+    if incremental:
+        manifest = RunManifest(output_folder, _run_config(threshold, highlighted_cars, labels_folder, layouts_folder, layout_pattern, render, detector, spot_classifier))
+        layout_keys = LayoutRegistry(layouts_folder, layout_pattern)
+
+        def dependencies(image_file):
+            layout_path = os.path.join(layouts_folder, layout_keys.key(image_file) + '.txt')
+            if labels_folder == '':
+                return [layout_path]
+            return [os.path.join(labels_folder, os.path.splitext(image_file)[0] + '.txt'), layout_path]
+
+        changed = manifest.changed(images_folder, image_files, dependencies)
+        if len(changed) < len(image_files):
+            previous_results = read_output_csv(os.path.join(output_folder, 'output.csv'))
+            reused = {image_file: previous_results[image_file] for image_file in set(image_files) - set(changed) if image_file in previous_results}
+            # Images missing from the previous output are processed again
+            changed = sorted(set(image_files) - set(reused))
+
+        # Remove the rendered images of the deleted images
+        for image_file in manifest.deleted:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(output_images_folder, image_file))
+        print(f'{len(changed)} new or changed images, {len(reused)} unchanged, {len(manifest.deleted)} deleted')
+        image_files = changed
+
+    # Without rendering, the image sizes come from the size cache and the images are never opened by the workers
+    sizes = ImageSizeCache(images_folder) if not render and detector is None and spot_classifier is None else None
+
+    # Image and annotation paths and image size of each image, the annotation file is in the ../labels/ folder
+    tasks = []
+    for image_file in image_files:
+        annotation_file = os.path.splitext(image_file)[0] + '.txt'
+        try:
+            size = sizes.get(image_file) if sizes is not None else None
+        except Exception: # Reported by the worker when it processes the image
+            size = None
+        tasks.append((os.path.join(images_folder, image_file), os.path.join(labels_folder, annotation_file), size))
+    if sizes is not None:
+        sizes.save()
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(len(tasks), 1))
+
+    if sinks is None:
+        sinks = [CsvSink(os.path.join(output_folder, 'output.csv')), DataFrameSink()]
+    # The next incremental run reuses the rows of output.csv, so it must be written
+    if incremental and not any(isinstance(sink, CsvSink) and os.path.abspath(sink.path) == os.path.abspath(os.path.join(output_folder, 'output.csv')) for sink in sinks):
+        sinks = list(sinks) + [CsvSink(os.path.join(output_folder, 'output.csv'))]
+
+    # Process each image and annotation in the folder
+    print('Processing images...')
+    failed_images = []
+    if spot_classifier is not None:
+        layouts = LayoutRegistry(layouts_folder, layout_pattern)
+        outcomes = _classifier_results(tasks, output_images_folder, highlighted_cars, layouts, render, spot_classifier, stats)
+    elif detector is not None:
+        layouts = LayoutRegistry(layouts_folder, layout_pattern)
+        outcomes = _detector_results(tasks, output_images_folder, threshold, highlighted_cars, layouts, render, detector, stats)
+    elif workers > 1:
+        outcomes = _pool_results(tasks, output_images_folder, threshold, highlighted_cars, layouts_folder, layout_pattern, render, workers, stats)
+    elif render and (read_threads > 0 or write_threads > 0):
+        layouts = LayoutRegistry(layouts_folder, layout_pattern)
+        outcomes = _pipeline_results(tasks, output_images_folder, threshold, highlighted_cars, layouts, read_threads, write_threads, queue_size, stats)
+    else:
+        layouts = LayoutRegistry(layouts_folder, layout_pattern)
+        outcomes = _serial_results(tasks, output_images_folder, threshold, highlighted_cars, layouts, render, stats)
+
+    if reused:
+        outcomes = _merge_results(reused, outcomes)
+
+    done_images = []
+    try:
+        for image_file, results, error in outcomes:
+            if error is not None:
+                failed_images.append(image_file)
+                print(f'Error processing {image_file}: {error}')
+                continue
+            done_images.append(image_file)
+            if image_file not in reused:
+                processed_images += 1
+            with stage_timer(stats, 'results'):
+                for sink in sinks:
+                    sink.write(results)
+    finally:
+        with stage_timer(stats, 'results'):
+            for sink in sinks:
+                sink.close()
+
+    print(f'Processed {processed_images} images ✅')
+    if failed_images:
+        print(f'Failed to process {len(failed_images)} images ❌')
+
+    # The failed images are not in the manifest, so they are retried by the next run
+    if incremental:
+        manifest.save(done_images)
+
+    if stats is not None:
+        stats.count('Failed images', len(failed_images))
+        if incremental:
+            stats.count('Reused images', len(reused))
+        stats.wall_time += time.perf_counter() - run_start
+        stats.peak_rss_mb = max(stats.peak_rss_mb, peak_rss_mb())
+        if stats_sidecar:
+            stats.save(os.path.join(output_folder, f'output_stats.{stats_sidecar}'))
+
+    for sink in sinks:
+        if isinstance(sink, DataFrameSink):
+            return sink.to_dataframe()
+    return None
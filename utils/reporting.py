@@ -0,0 +1,353 @@
+# utils/reporting.py
+
+# pylint: disable=unsubscriptable-object
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import os
+
+from PIL import Image
+
+try:
+    from utils.model_resolution import ROOT
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from model_resolution import ROOT
+
+
+## Models comparison functions ##
+
+# Function to average the metrics of the folds of each model (rows named <model>_fold_<i>, e.g. yolov5n_fold_0)
+# The size and parameters of a model are the ones of its first fold, the models keep the order of the DataFrame
+def mean_df(df: pd.DataFrame):
+    # Specify the columns for which you want to calculate the mean
+    columns_to_mean = ['Precision', 'Recall', 'mAP0-50', 'mAP50-95']
+
+    # yolov5n_fold_0 -> YOLOv5n
+    models = df['Model'].str.replace(r'_fold_\d+$', '', regex=True).str.replace(r'^yolo', 'YOLO', regex=True)
+
+    # Calculate the average values for each model precision, recall, and mAP
+    grouped = df.groupby(models, sort=False)
+    new_df = grouped[['Model Size (MB)', 'Parameters']].first().join(grouped[columns_to_mean].mean())
+
+    return new_df.rename_axis('Model').reset_index()
+
+
+def plot_model_size(df: pd.DataFrame):
+    sorted_df = df.sort_values('Model Size (MB)')  # Sort DataFrame by 'Model Size (MB)'
+
+    plt.figure(figsize=(10, 6))
+    colors = ['blue', 'green', 'red', 'orange']
+    bars = plt.bar(range(len(sorted_df)), sorted_df['Model Size (MB)'], color=colors)
+
+    plt.xlabel('Trained Model')
+    plt.ylabel('Model Size (MB)')
+    plt.title('Size Comparison')
+
+    plt.xticks(range(len(sorted_df)), sorted_df['Model'])
+
+    for bar, model_name in zip(bars, sorted_df['Model']):
+        height = bar.get_height()
+        plt.text(bar.get_x() + bar.get_width() / 2, height, str(height), ha='center', va='bottom')
+        bar.set_label(model_name)
+
+    plt.legend(loc='upper left')
+
+    # Create a temporary directory to store the plot as an image file
+    if not os.path.exists(f'{ROOT}/models/plots'):
+        os.makedirs(f'{ROOT}/models/plots')
+
+    plt.savefig(f'{ROOT}/models/plots/01_model_size.jpg')  # Save the plot as an image file
+
+    plt.show()
+    
+# Parameters and GFLOPs Comparison
+def plot_model_params(df: pd.DataFrame):
+    sorted_df_params = df.sort_values('Parameters')  # Sort DataFrame by 'Parameters'
+    plt.figure(figsize=(10, 6))
+
+    # Plotting Model Parameters
+    colors = ['blue', 'green', 'red', 'orange']
+    bars_params = plt.bar(range(len(sorted_df_params)), sorted_df_params['Parameters'], color=colors)
+
+    plt.xlabel('Trained Model')
+    plt.ylabel('Parameters')
+    plt.title('Parameters Comparison')
+    plt.xticks(range(len(sorted_df_params)), sorted_df_params['Model'])
+
+    for bar, model_name in zip(bars_params, sorted_df_params['Model']):
+        height = bar.get_height()
+        plt.text(bar.get_x() + bar.get_width() / 2, height, str(height), ha='center', va='bottom')
+        bar.set_label(model_name)
+
+    # Format y-axis labels
+    plt.ticklabel_format(style='plain', axis='y')
+
+    plt.legend(loc='upper left')
+
+    # Create a temporary directory to store the plot as an image file
+    if not os.path.exists(f'{ROOT}/models/plots'):
+        os.makedirs(f'{ROOT}/models/plots')
+
+    plt.savefig(f'{ROOT}/models/plots/02_model_params.jpg')  # Save the plot as an image file
+
+
+    plt.show()
+
+    
+
+# Plot the Precision and Recall
+def plot_precision_recall(df: pd.DataFrame):
+    plt.figure(figsize=(10, 6))
+    bar_width = 0.35
+    index = np.arange(len(df))
+
+    plt.bar(index, df['Precision'], width=bar_width, label='Precision')
+    plt.bar(index + bar_width, df['Recall'], width=bar_width, label='Recall')
+
+    plt.xlabel('Trained Model')
+    plt.ylabel('Score')
+    plt.title('Precision and Recall Comparison')
+    plt.xticks(index + bar_width / 2, df['Model'])
+    plt.ylim([0.80, 1])
+    plt.legend()
+
+    # Create a temporary directory to store the plot as an image file
+    if not os.path.exists(f'{ROOT}/models/plots'):
+        os.makedirs(f'{ROOT}/models/plots')
+
+    plt.savefig(f'{ROOT}/models/plots/03_model_precision_recall.jpg')  # Save the plot as an image file
+
+    plt.show()
+
+# Plot the mAP50-95
+def plot_mAP(df: pd.DataFrame):
+    sorted_df = df.sort_values('mAP50-95')  # Sort DataFrame by 'mAP50-95'
+
+    plt.figure(figsize=(10, 6))
+    colors = ['blue', 'green', 'red', 'orange']
+    bars = plt.bar(range(len(sorted_df)), sorted_df['mAP50-95'], color=colors)
+
+    plt.xlabel('Trained Model')
+    plt.ylabel('mAP50-95')
+    plt.title('mAP 50-95% Comparison')
+
+    plt.xticks(range(len(sorted_df)), sorted_df['Model'])
+
+    for bar, model_name in zip(bars, sorted_df['Model']):
+        height = bar.get_height()
+        plt.text(bar.get_x() + bar.get_width() / 2, height, f'{height:.3f}', ha='center', va='bottom')
+        bar.set_label(model_name)
+
+    plt.legend(loc='upper left')
+
+    plt.ylim([0.6, 1])
+
+    # Create a temporary directory to store the plot as an image file
+    if not os.path.exists(f'{ROOT}/models/plots'):
+        os.makedirs(f'{ROOT}/models/plots')
+
+    plt.savefig(f'{ROOT}/models/plots/04_model_map.jpg')  # Save the plot as an image file
+
+    plt.show()
+
+# Get images from plots
+def save_plots(path: str = f'{ROOT}/models/plots/'):
+    # Let's combine the plots into one image, vertically
+    images = []
+    for file in os.listdir(path):
+        if file.endswith('.jpg'):
+            images.append(Image.open(os.path.join(path, file)))
+
+    widths, heights = zip(*(i.size for i in images))
+
+    max_width = max(widths)
+    total_height = sum(heights)
+
+    new_im = Image.new('RGB', (max_width, total_height))
+
+    y_offset = 0
+    for im in images:
+        new_im.paste(im, (0, y_offset))
+        y_offset += im.size[1]
+   
+    # Save the combined image
+    new_im.save(f'{ROOT}/models/models_comparison.jpg')
+
+
+## Evaluation engine ##
+# Compares the occupancy results of any number of models with the ground truth, aligned by image file
+
+# Count columns of the process_images results, in order
+COUNT_COLUMNS = [
+    'Disabled parking spots', 'Parking spots', 'Cars', 'Empty disabled parking spots', 'Occupied disabled parking spots',
+    'Empty parking spots', 'Occupied parking spots', 'Cars in transit or parked in non-parking spots'
+]
+
+# Count columns compared by get_results_df (the number of spots comes from the layout, so it is always right)
+RESULTS_COLUMNS = [
+    'Cars', 'Occupied disabled parking spots', 'Empty disabled parking spots', 'Occupied parking spots',
+    'Empty parking spots', 'Cars in transit or parked in non-parking spots'
+]
+
+# Function to compare the process_images results of each model with the ground truth results
+# results is a {model name: DataFrame} dict, the rows are matched by 'Image File', so the order of the rows doesn't matter
+# For every count column (default: the count columns of the ground truth) returns the accuracy (fraction of images
+# with the exact count) and the mean absolute error of each model. An image missing from the results of a model
+# counts as wrong in the accuracy, and is left out of the MAE
+def evaluate_counts(ground_truth: pd.DataFrame, results, columns=None):
+    if columns is None:
+        columns = [column for column in COUNT_COLUMNS if column in ground_truth.columns]
+
+    truth = ground_truth.set_index('Image File')[columns].to_numpy(dtype=np.float64)
+    image_files = ground_truth['Image File']
+
+    # (models, images, columns) counts, NaN where a model has no result
+    predictions = np.stack([
+        df.set_index('Image File')[columns].reindex(image_files).to_numpy(dtype=np.float64)
+        for df in results.values()
+    ]) if results else np.empty((0,) + truth.shape)
+
+    errors = np.abs(predictions - truth[None])
+    missing = np.isnan(predictions).all(axis=2)
+    with np.errstate(invalid='ignore'):
+        accuracy = (errors == 0).mean(axis=1)
+    mae = np.full((len(results), len(columns)), np.nan)
+    counted = (~np.isnan(errors)).sum(axis=1)
+    np.divide(np.nansum(errors, axis=1), counted, out=mae, where=counted > 0)
+
+    report = pd.DataFrame({'Model': list(results)})
+    for c, column in enumerate(columns):
+        report[f'{column} Accuracy'] = accuracy[:, c]
+    for c, column in enumerate(columns):
+        report[f'{column} MAE'] = mae[:, c]
+    report['Missing images'] = missing.sum(axis=1)
+    return report
+
+# Function to get the max IoU between each parking spot and the cars of every image
+# The parking spots come from the layouts (default: the ground truth labels), the cars from labels_folder
+# Returns the class id (N,) and max IoU (N,) of the spots of all the images, the offsets of each image in them (images + 1,)
+# and the number of cars of each image
+def spot_max_ious(data_path: str, labels_folder: str, image_files, layouts_folder: str = '', layout_pattern: str = ''):
+    try:
+        from utils.occupancy import ImageSizeCache
+        from utils.geometry import load_labels, yolo_to_pixel_boxes, iou_matrix, LayoutRegistry
+    except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+        from occupancy import ImageSizeCache
+        from geometry import load_labels, yolo_to_pixel_boxes, iou_matrix, LayoutRegistry
+
+    images_folder = os.path.join(data_path, 'images/')
+    layouts = LayoutRegistry(layouts_folder or os.path.join(data_path, 'labels/'), layout_pattern)
+    sizes = ImageSizeCache(images_folder)
+
+    class_ids, max_ious, offsets, cars = [], [], [0], []
+    for image_file in image_files:
+        image_width, image_height = sizes.get(image_file)
+        spot_class_ids, spot_boxes = layouts.get_pixels(image_file, image_width, image_height)
+
+        # An image without detections has no label file
+        try:
+            labels = load_labels(os.path.join(labels_folder, os.path.splitext(image_file)[0] + '.txt'))
+        except FileNotFoundError:
+            labels = np.empty((0, 5), dtype=np.float64)
+        car_boxes = yolo_to_pixel_boxes(labels[labels[:, 0] == 0, 1:], image_width, image_height)
+
+        # Same rule as compute_occupancy: the best car of each spot, no car means an IoU of 0
+        ious = iou_matrix(spot_boxes, car_boxes)
+        max_ious.append(ious.max(axis=1) if ious.shape[1] else np.zeros(len(spot_boxes)))
+        class_ids.append(spot_class_ids)
+        offsets.append(offsets[-1] + len(spot_boxes))
+        cars.append(len(car_boxes))
+    sizes.save()
+
+    return np.concatenate(class_ids + [np.empty(0)]), np.concatenate(max_ious + [np.empty(0)]), np.array(offsets), np.array(cars)
+
+# Function to count the spots and cars of every image for every threshold, with the same rules as occupancy_counts
+# occupied is the (N, thresholds) occupancy of the spots, returns a (images, thresholds, COUNT_COLUMNS) array
+def _sweep_counts(class_ids, occupied, offsets, cars):
+    def per_image(values):
+        # Sum of the spots of each image, without a loop over the images
+        cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+        return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+    disabled = (class_ids == 1)[:, None]
+    regular = (class_ids == 2)[:, None]
+    disabled_spots = np.broadcast_to(per_image(disabled.astype(np.float64)), (len(cars), occupied.shape[1]))
+    spots = np.broadcast_to(per_image(regular.astype(np.float64)), (len(cars), occupied.shape[1]))
+    occupied_disabled = per_image((occupied & disabled).astype(np.float64))
+    occupied_regular = per_image((occupied & regular).astype(np.float64))
+    cars = np.broadcast_to(cars[:, None].astype(np.float64), occupied_regular.shape)
+
+    return np.stack([
+        disabled_spots, spots, cars, disabled_spots - occupied_disabled, occupied_disabled,
+        spots - occupied_regular, occupied_regular, cars - occupied_disabled - occupied_regular
+    ], axis=2)
+
+# Function to evaluate any number of models over a list of IoU thresholds, from the labels they predicted
+# models is a {model name: model name or labels folder} dict, like the model argument of process_images
+# The ground truth is the occupancy of the ground truth labels at reference_threshold. The spot x car IoU matrix of
+# each image is computed once per model and reused for every threshold. For each (model, threshold) returns
+# the accuracy and MAE of every count column, and the confusion matrix of the occupancy of the parking spots
+# (all spots, then the disabled and the regular spots)
+def evaluate_thresholds(data_path: str, models, thresholds=(0.4,), reference_threshold: float = 0.4, layouts_folder: str = '', layout_pattern: str = ''):
+    try:
+        from utils.model_resolution import model_labels_folder
+        from utils.geometry import list_files
+    except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+        from model_resolution import model_labels_folder
+        from geometry import list_files
+
+    images_folder = os.path.join(data_path, 'images/')
+    image_files = list_files(images_folder)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    # Ground truth occupancy of every spot and counts of every image
+    class_ids, truth_ious, offsets, truth_cars = spot_max_ious(data_path, os.path.join(data_path, 'labels/'), image_files, layouts_folder, layout_pattern)
+    truth = truth_ious > reference_threshold
+    truth_counts = _sweep_counts(class_ids, truth[:, None], offsets, truth_cars)
+
+    spot_groups = {'Spots': class_ids > 0, 'Disabled spots': class_ids == 1, 'Regular spots': class_ids == 2}
+
+    rows = []
+    for name, model in models.items():
+        _, max_ious, _, cars = spot_max_ious(data_path, model_labels_folder(model), image_files, layouts_folder, layout_pattern)
+        occupied = max_ious[:, None] > thresholds[None, :]
+        counts = _sweep_counts(class_ids, occupied, offsets, cars)
+
+        errors = np.abs(counts - truth_counts)
+        accuracy = (errors == 0).mean(axis=0) if len(image_files) else np.full(errors.shape[1:], np.nan)
+        mae = errors.mean(axis=0) if len(image_files) else np.full(errors.shape[1:], np.nan)
+
+        # Confusion matrix of the spots for every threshold at once
+        confusion = {}
+        for group, mask in spot_groups.items():
+            group_truth = truth[mask][:, None]
+            group_occupied = occupied[mask]
+            confusion[f'{group} TP'] = (group_truth & group_occupied).sum(axis=0)
+            confusion[f'{group} FP'] = (~group_truth & group_occupied).sum(axis=0)
+            confusion[f'{group} FN'] = (group_truth & ~group_occupied).sum(axis=0)
+            confusion[f'{group} TN'] = (~group_truth & ~group_occupied).sum(axis=0)
+
+        for t, threshold in enumerate(thresholds.tolist()):
+            row = {'Model': name, 'Threshold': threshold}
+            row.update({f'{column} Accuracy': accuracy[t, c] for c, column in enumerate(COUNT_COLUMNS)})
+            row.update({f'{column} MAE': mae[t, c] for c, column in enumerate(COUNT_COLUMNS)})
+            row.update({key: int(values[t]) for key, values in confusion.items()})
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+# Function to get the accuracy of the counts of each model, compared with the ground truth results (df)
+# The models are the next DataFrames (the names default to YOLOv5n, YOLOv5s, YOLOv8n and YOLOv8s for four models)
+# or a {model name: DataFrame} dict, see evaluate_counts
+def get_results_df(df: pd.DataFrame, *model_dfs, models=None):
+    if len(model_dfs) == 1 and isinstance(model_dfs[0], dict):
+        results = model_dfs[0]
+    else:
+        if models is None:
+            models = ['YOLOv5n', 'YOLOv5s', 'YOLOv8n', 'YOLOv8s'] if len(model_dfs) == 4 else [f'Model {i}' for i in range(len(model_dfs))]
+        results = dict(zip(models, model_dfs))
+
+    report = evaluate_counts(df, results, RESULTS_COLUMNS)
+    return report[['Model'] + [f'{column} Accuracy' for column in RESULTS_COLUMNS]]
@@ -0,0 +1,257 @@
+# utils/service.py
+
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import numpy as np
+import cv2
+import os
+import re
+import json
+import time
+import queue
+import argparse
+import threading
+
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    from utils.functions import LayoutRegistry, draw_bounding_boxes
+    from utils.detector import load_detector
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from functions import LayoutRegistry, draw_bounding_boxes
+    from detector import load_detector
+
+
+## Micro-batching scheduler ##
+
+# Scheduler coalescing the images submitted by concurrent requests into detector batches
+# A batch is run as soon as it has max_batch images, or max_wait_ms after its first image arrived
+class BatchScheduler:
+    def __init__(self, detector, max_batch: int = 0, max_wait_ms: float = 10.0):
+        self.detector = detector
+        self.max_batch = max_batch or detector.batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_images = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Function to submit a BGR image, the returned future gets its (K,5) car labels
+    def submit(self, image):
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            # Wait for more images until the batch is full or the deadline of its first image
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                batch.append(item)
+
+            images, futures = zip(*batch)
+            try:
+                labels = self.detector.predict(list(images))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_images += len(batch)
+            for future, image_labels in zip(futures, labels):
+                future.set_result(image_labels)
+
+
+## Service ##
+
+# Request counters and latencies of the service, the percentiles use the last max_latencies requests
+class ServiceMetrics:
+    def __init__(self, max_latencies: int = 10000):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=max_latencies)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self.latencies, dtype=np.float64) * 1000
+            requests, errors = self.requests, self.errors
+        uptime = time.perf_counter() - self.started
+        return {
+            'Requests': requests,
+            'Errors': errors,
+            'Uptime (s)': uptime,
+            'Throughput (req/s)': requests / uptime if uptime else 0.0,
+            'Latency p50 (ms)': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'Latency p99 (ms)': float(np.percentile(latencies, 99)) if len(latencies) else None
+        }
+
+# Valid lot ids, the lot id is used as the layout file name
+LOT_ID_PATTERN = re.compile(r'[\w-]+')
+
+# Occupancy service holding the detector and the lot layouts (one <lot id>.txt per lot) in memory
+class OccupancyService:
+    def __init__(self, detector, layouts_folder: str, layout_pattern: str = '', threshold: float = 0.4, max_batch: int = 0, max_wait_ms: float = 10.0):
+        self.detector = detector
+        self.layouts = LayoutRegistry(layouts_folder, layout_pattern)
+        self.threshold = threshold
+        self.scheduler = BatchScheduler(detector, max_batch, max_wait_ms)
+        self.metrics = ServiceMetrics()
+
+        # Load every layout and run the detector once, so that the first requests do not pay for it
+        for entry in os.scandir(layouts_folder):
+            if entry.is_file() and entry.name.endswith('.txt'):
+                self.layouts.get(entry.name)
+        self.detector.predict([np.zeros((64, 64, 3), dtype=np.uint8)])
+
+    # Function to get the occupancy of a lot from encoded image bytes, returns the counts of draw_bounding_boxes
+    # The lot id is also the layout file name, so only letters, digits, '_' and '-' are accepted
+    # The 'Image File' of the record is the optional filename given by the camera, it is left out without one
+    def occupancy(self, image_bytes: bytes, lot: str, filename: str = ''):
+        if not LOT_ID_PATTERN.fullmatch(lot):
+            raise ValueError(f'Invalid lot id {lot!r}')
+        # An unknown lot fails here (FileNotFoundError, 404) before it takes a detector batch slot
+        self.layouts.get(lot)
+
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('Could not decode the image')
+
+        cars = self.scheduler.submit(image).result()
+        results = draw_bounding_boxes(lot, cars, '', self.threshold, False, self.layouts, render=False, image=image)
+        del results['Image File']
+        if filename:
+            results = {'Image File': os.path.basename(filename), **results}
+        return results
+
+    def get_metrics(self):
+        metrics = self.metrics.snapshot()
+        metrics['Batches'] = self.scheduler.batches
+        metrics['Mean batch size'] = self.scheduler.batched_images / self.scheduler.batches if self.scheduler.batches else None
+        return metrics
+
+    def close(self):
+        self.scheduler.close()
+
+
+# HTTP handler of the service:
+# POST /occupancy?lot=<lot id>&filename=<image file> with the image bytes as body (the lot id and the optional
+# file name can also be sent in the X-Lot-Id and X-Filename headers)
+# GET /metrics
+class OccupancyHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/metrics':
+            return self._send_json(404, {'error': 'Not found'})
+        self._send_json(200, self.server.service.get_metrics())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/occupancy':
+            return self._send_json(404, {'error': 'Not found'})
+
+        start = time.perf_counter()
+        service = self.server.service
+        image_bytes = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        query = parse_qs(url.query)
+        lot = query.get('lot', [self.headers.get('X-Lot-Id', '')])[0]
+        filename = query.get('filename', [self.headers.get('X-Filename', '')])[0]
+
+        try:
+            if not lot:
+                raise ValueError('Missing lot id')
+            status, data = 200, service.occupancy(image_bytes, lot, filename)
+        except ValueError as e:
+            status, data = 400, {'error': str(e)}
+        except FileNotFoundError:
+            status, data = 404, {'error': f'Unknown lot {lot}'}
+        except Exception as e:
+            status, data = 500, {'error': str(e)}
+
+        service.metrics.record(time.perf_counter() - start, status != 200)
+        self._send_json(status, data)
+
+    # Requests are counted in /metrics, do not log each one
+    def log_message(self, format, *args):
+        pass
+
+class OccupancyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service: OccupancyService):
+        super().__init__(address, OccupancyHandler)
+        self.service = service
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, required=True, help='model name (e.g. yolov8s_fold_0) or weights path')
+    parser.add_argument('--yoloversion', type=str, default='8', help='YOLO version of the model (5 or 8)')
+    parser.add_argument('--runtime', type=str, default='torch', choices=['torch', 'onnx'], help='detector runtime')
+    parser.add_argument('--layouts', type=str, required=True, help='folder with one <lot id>.txt layout per lot')
+    parser.add_argument('--layout-pattern', type=str, default='', help='regex extracting the layout key from the lot id')
+    parser.add_argument('--threshold', type=float, default=0.4, help='IoU threshold of an occupied spot')
+    parser.add_argument('--imgsz', type=int, default=1920, help='inference size')
+    parser.add_argument('--batch-size', type=int, default=4, help='maximum detector batch size')
+    parser.add_argument('--detection-cache', type=str, default='', help='path of a SQLite cache of the detected cars')
+    parser.add_argument('--detection-cache-mb', type=float, default=256, help='maximum size of the detection cache')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0, help='maximum wait for a batch to fill')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='host to bind')
+    parser.add_argument('--port', type=int, default=8000, help='port to bind')
+    opt = parser.parse_args()
+    return opt
+
+def main(opt):
+    detector = load_detector(opt.model, opt.yoloversion, opt.runtime, opt.detection_cache, opt.detection_cache_mb, imgsz=opt.imgsz, batch_size=opt.batch_size)
+
+    service = OccupancyService(detector, opt.layouts, opt.layout_pattern, opt.threshold, opt.batch_size, opt.max_wait_ms)
+    server = OccupancyServer((opt.host, opt.port), service)
+    print(f"Serving on http://{opt.host}:{opt.port} ✅")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,188 @@
+# utils/spot_classifier.py
+
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import torch
+import numpy as np
+import cv2
+import os
+import time
+import hashlib
+
+from torch import nn
+
+try:
+    from utils.functions import LayoutRegistry, list_files, load_labels, yolo_to_pixel_boxes, compute_occupancy
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from functions import LayoutRegistry, list_files, load_labels, yolo_to_pixel_boxes, compute_occupancy
+
+
+# Function to crop every parking spot (N,4 pixel boxes) of a BGR image and resize the crops to (crop_size, crop_size)
+# Returns an (N, crop_size, crop_size, 3) uint8 array
+def crop_spots(image, spot_boxes, crop_size: int = 32):
+    height, width = image.shape[:2]
+    crops = np.zeros((len(spot_boxes), crop_size, crop_size, 3), dtype=np.uint8)
+    for i, (left, top, right, bottom) in enumerate(np.asarray(spot_boxes, dtype=np.int64).tolist()):
+        left, top = max(left, 0), max(top, 0)
+        right, bottom = min(right, width), min(bottom, height)
+        if right > left and bottom > top:
+            crops[i] = cv2.resize(image[top:bottom, left:right], (crop_size, crop_size), interpolation=cv2.INTER_AREA)
+    return crops
+
+
+# Small CNN classifying a parking spot crop as empty (0) or occupied (1)
+class SpotNet(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.features = nn.Sequential(
+            nn.Conv2d(3, 16, 3, padding=1), nn.BatchNorm2d(16), nn.ReLU(), nn.MaxPool2d(2),
+            nn.Conv2d(16, 32, 3, padding=1), nn.BatchNorm2d(32), nn.ReLU(), nn.MaxPool2d(2),
+            nn.Conv2d(32, 64, 3, padding=1), nn.BatchNorm2d(64), nn.ReLU(), nn.AdaptiveAvgPool2d(1)
+        )
+        self.classifier = nn.Linear(64, 1)
+
+    def forward(self, x):
+        return self.classifier(self.features(x).flatten(1)).squeeze(1)
+
+
+# Occupancy backend classifying all the parking spot crops of a frame in one batched forward pass,
+# a cheap alternative to full-frame detection + IoU when the spot layout is known
+class SpotClassifier:
+    def __init__(self, crop_size: int = 32, threshold: float = 0.5, device: str = 'cpu'):
+        self.crop_size = crop_size
+        self.threshold = threshold
+        self.device = device
+        self.model = SpotNet().to(device).eval()
+
+    # Function to convert (N, crop, crop, 3) uint8 BGR crops into a normalized float tensor
+    def _to_tensor(self, crops):
+        return torch.from_numpy(np.ascontiguousarray(crops.transpose(0, 3, 1, 2))).to(self.device).float() / 255
+
+    # Function to get the occupied probability of each crop
+    @torch.inference_mode()
+    def predict_crops(self, crops):
+        if len(crops) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return torch.sigmoid(self.model(self._to_tensor(crops))).cpu().numpy().astype(np.float64)
+
+    # Function to check which parking spots (N,4 pixel boxes) of a BGR image are occupied
+    # Returns the occupied mask and the occupied probability of each spot
+    def predict(self, image, spot_boxes):
+        probabilities = self.predict_crops(crop_spots(image, spot_boxes, self.crop_size))
+        return probabilities > self.threshold, probabilities
+
+    # Function to get a hash of the weights and settings of the classifier, e.g. to know if previous results are still valid
+    def fingerprint(self):
+        digest = hashlib.blake2b(f'{self.crop_size}:{self.threshold}'.encode(), digest_size=16)
+        for name, tensor in self.model.state_dict().items():
+            digest.update(name.encode())
+            digest.update(tensor.detach().cpu().numpy().tobytes())
+        return digest.hexdigest()
+
+    def save(self, path: str):
+        torch.save({'crop_size': self.crop_size, 'threshold': self.threshold, 'state_dict': self.model.state_dict()}, path)
+
+    @classmethod
+    def load(cls, path: str, device: str = 'cpu'):
+        checkpoint = torch.load(path, map_location=device)
+        classifier = cls(checkpoint['crop_size'], checkpoint['threshold'], device)
+        classifier.model.load_state_dict(checkpoint['state_dict'])
+        return classifier
+
+
+# Function to build a crop dataset from the ground truth labels: each parking spot (class 1 and 2) is labeled
+# occupied or empty with the same IoU rule as is_occupied, using the ground truth cars (class 0)
+# Returns the crops (N, crop, crop, 3), the labels (N,) and the image file of each crop
+def build_spot_dataset(data_path: str, threshold: float = 0.4, crop_size: int = 32, image_files=None):
+    images_folder = os.path.join(data_path, 'images')
+    if image_files is None:
+        image_files = list_files(images_folder)
+
+    crops, labels, files = [], [], []
+    for image_file in image_files:
+        image = cv2.imread(os.path.join(images_folder, image_file))
+        boxes = load_labels(os.path.join(data_path, 'labels', os.path.splitext(image_file)[0] + '.txt'))
+        pixel_boxes = yolo_to_pixel_boxes(boxes[:, 1:], image.shape[1], image.shape[0])
+
+        spot_mask = (boxes[:, 0] == 1) | (boxes[:, 0] == 2)
+        occupied, _, _ = compute_occupancy(pixel_boxes[spot_mask], pixel_boxes[boxes[:, 0] == 0], threshold)
+
+        crops.append(crop_spots(image, pixel_boxes[spot_mask], crop_size))
+        labels.append(occupied)
+        files.extend([image_file] * len(occupied))
+
+    return np.concatenate(crops), np.concatenate(labels), np.array(files)
+
+# Function to train a SpotClassifier on the ground truth labels of data_path
+# Horizontal/vertical flips are used as augmentation, the accuracy on the val_images is printed when given
+def train_spot_classifier(data_path: str, threshold: float = 0.4, crop_size: int = 32, epochs: int = 30, batch_size: int = 256, lr: float = 1e-3, val_images=None, seed: int = 0, device: str = 'cpu'):
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+
+    crops, labels, files = build_spot_dataset(data_path, threshold, crop_size)
+    val_mask = np.isin(files, val_images) if val_images is not None else np.zeros(len(files), dtype=bool)
+
+    classifier = SpotClassifier(crop_size, device=device)
+    model = classifier.model
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    # Most spots are empty, weight the occupied ones accordingly
+    train_labels = labels[~val_mask]
+    pos_weight = torch.tensor((len(train_labels) - train_labels.sum()) / max(train_labels.sum(), 1), device=device)
+    loss_function = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+
+    train_crops = crops[~val_mask]
+    for epoch in range(epochs):
+        model.train()
+        order = rng.permutation(len(train_crops))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            x = classifier._to_tensor(train_crops[batch])
+            if rng.random() < 0.5:
+                x = x.flip(3)
+            if rng.random() < 0.5:
+                x = x.flip(2)
+            y = torch.from_numpy(train_labels[batch].astype(np.float32)).to(device)
+
+            optimizer.zero_grad()
+            loss = loss_function(model(x), y)
+            loss.backward()
+            optimizer.step()
+    model.eval()
+
+    if val_mask.any():
+        occupied = classifier.predict_crops(crops[val_mask]) > classifier.threshold
+        print(f'Spot classifier validation accuracy: {(occupied == labels[val_mask]).mean():.3f}')
+
+    print("Spot classifier trained ✅")
+    return classifier
+
+
+# Function to compare the spot classifier with the detection path (detector + IoU) on the images of data_path
+# Returns, for each backend, the time per frame and the per-spot accuracy against the ground truth occupancy
+def benchmark_spot_classifier(data_path: str, classifier: SpotClassifier, detector=None, threshold: float = 0.4):
+    images_folder = os.path.join(data_path, 'images')
+    image_files = list_files(images_folder)
+    layouts = LayoutRegistry(os.path.join(data_path, 'labels'))
+    _, truth, _ = build_spot_dataset(data_path, threshold, classifier.crop_size, image_files)
+
+    images = [cv2.imread(os.path.join(images_folder, f)) for f in image_files]
+    spots = [layouts.get_pixels(f, image.shape[1], image.shape[0])[1] for f, image in zip(image_files, images)]
+
+    backends = {'Spot classifier': lambda image, spot_boxes: classifier.predict(image, spot_boxes)[0]}
+    if detector is not None:
+        def detection(image, spot_boxes):
+            cars = detector.predict([image])[0]
+            car_boxes = yolo_to_pixel_boxes(cars[:, 1:], image.shape[1], image.shape[0])
+            return compute_occupancy(spot_boxes, car_boxes, threshold)[0]
+        backends['Detection'] = detection
+
+    report = {}
+    for name, backend in backends.items():
+        backend(images[0], spots[0]) # Warm up
+        start = time.perf_counter()
+        occupied = np.concatenate([backend(image, spot_boxes) for image, spot_boxes in zip(images, spots)])
+        report[name] = {
+            'ms/frame': (time.perf_counter() - start) * 1000 / len(images),
+            'Spot accuracy': float((occupied == truth).mean())
+        }
+    return report
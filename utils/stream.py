@@ -0,0 +1,183 @@
+# utils/stream.py
+
+# pyright: reportUnknownMemberType=none, reportUnknownVariableType=none
+
+import numpy as np
+import cv2
+import os
+
+try:
+    from utils.functions import LayoutRegistry, list_files, yolo_to_pixel_boxes, compute_occupancy, occupancy_counts
+except ModuleNotFoundError: # Run from the utils folder, like yolov5start.py
+    from functions import LayoutRegistry, list_files, yolo_to_pixel_boxes, compute_occupancy, occupancy_counts
+
+
+# Generator reading the frames of a video file or of a folder of images (sorted by name)
+# Yields (frame index, timestamp in seconds, BGR frame), step skips frames, fps is used for image folders
+def read_frames(source: str, step: int = 1, fps: float = 1.0):
+    if os.path.isdir(source):
+        image_files = list_files(source)
+        for index in range(0, len(image_files), step):
+            frame = cv2.imread(os.path.join(source, image_files[index]))
+            if frame is not None:
+                yield index, index / fps, frame
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise FileNotFoundError(f'Could not open video {source}')
+    fps = capture.get(cv2.CAP_PROP_FPS) or fps
+    try:
+        index = 0
+        while True:
+            # grab() skips the decoding of the frames that are not used
+            if not capture.grab():
+                break
+            if index % step == 0:
+                success, frame = capture.retrieve()
+                if not success:
+                    break
+                yield index, index / fps, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+# Function to get a small grayscale version of a frame, used to measure the changes of the parking spots
+def change_image(frame, scale: float):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+# Function to compute the mean absolute pixel difference of each parking spot (N,4 boxes in the small image)
+# between the small image of a frame and the reference image, all spots at once with an integral image
+def spot_change_scores(small, reference, small_boxes):
+    integral = cv2.integral(cv2.absdiff(small, reference))
+    left, top, right, bottom = small_boxes[:, 0], small_boxes[:, 1], small_boxes[:, 2], small_boxes[:, 3]
+    sums = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+    areas = np.maximum((right - left) * (bottom - top), 1)
+    return sums / areas
+
+
+# Generator evaluating the parking spots of a stream of frames from a fixed camera
+# Each parking spot keeps its state, and only the spots whose pixels changed more than change_threshold
+# (mean absolute gray level difference) since they were last evaluated are evaluated again:
+# - with a spot_classifier (utils.spot_classifier.SpotClassifier), only the changed spots are classified
+# - with a detector (utils.detector.Detector), the detector only runs when any spot changed
+# The spots come from the layouts folder, layout is the layout key of the camera (e.g. 'set1')
+# Yields (frame index, timestamp, spot class ids, occupied, max IoU, cars, changed) for each frame,
+# max IoU and cars are None with a spot classifier
+def stream_occupancy(source: str, layouts_folder: str, layout: str, detector=None, spot_classifier=None, threshold: float = 0.4, change_threshold: float = 8.0, change_scale: float = 0.25, step: int = 1, fps: float = 1.0):
+    if (detector is None) == (spot_classifier is None):
+        raise ValueError('The stream needs either a detector or a spot_classifier')
+
+    layouts = LayoutRegistry(layouts_folder)
+    reference = None
+    occupied = None
+    max_iou = None
+    cars = None
+
+    for index, timestamp, frame in read_frames(source, step, fps):
+        image_height, image_width = frame.shape[:2]
+        class_ids, spot_boxes = layouts.get_pixels(layout, image_width, image_height)
+
+        small = change_image(frame, change_scale)
+        small_boxes = np.clip((spot_boxes * change_scale).astype(np.int64), 0, [small.shape[1], small.shape[0], small.shape[1], small.shape[0]])
+
+        # Spots that changed since they were last evaluated (all of them on the first frame)
+        if reference is None:
+            changed = np.ones(len(class_ids), dtype=bool)
+            reference = small.copy()
+            occupied = np.zeros(len(class_ids), dtype=bool)
+        else:
+            changed = spot_change_scores(small, reference, small_boxes) > change_threshold
+
+        if spot_classifier is not None:
+            if changed.any():
+                occupied[changed], _ = spot_classifier.predict(frame, spot_boxes[changed])
+                # The reference only moves for the evaluated spots, so slow changes add up until they are evaluated
+                for left, top, right, bottom in small_boxes[changed].tolist():
+                    reference[top:bottom, left:right] = small[top:bottom, left:right]
+        elif changed.any():
+            car_labels = detector.predict([frame])[0]
+            car_boxes = yolo_to_pixel_boxes(car_labels[:, 1:], image_width, image_height)
+            occupied, _, max_iou = compute_occupancy(spot_boxes, car_boxes, threshold)
+            cars = len(car_labels)
+            changed[:] = True
+            reference = small
+
+        yield index, timestamp, class_ids, occupied, max_iou, cars, changed
+
+# Generator processing a stream of frames (see stream_occupancy), yields one record per frame with the frame index,
+# the timestamp, the counts of process_images and the number of re-evaluated spots
+def process_stream(source: str, layouts_folder: str, layout: str, **kwargs):
+    for index, timestamp, class_ids, occupied, _, cars, changed in stream_occupancy(source, layouts_folder, layout, **kwargs):
+        results = {'Frame': index, 'Timestamp': timestamp}
+        if cars is None:
+            results.update(occupancy_counts(class_ids, occupied, with_cars=False))
+        else:
+            results.update(occupancy_counts(np.concatenate([class_ids, np.zeros(cars)]), np.concatenate([occupied, np.zeros(cars, dtype=bool)])))
+        results['Re-evaluated spots'] = int(np.count_nonzero(changed))
+        yield results
+
+
+## Temporal tracking ##
+
+# Per-spot occupancy state over a sequence of frames, with debouncing: a spot only flips after flip_frames
+# consecutive frames disagreeing with its state, which removes the flicker of single frame misses
+# update() returns the events of the spots that flipped, counts holds the counts of process_images, kept up to date
+class OccupancyTracker:
+    def __init__(self, flip_frames: int = 3):
+        self.flip_frames = flip_frames
+        self.class_ids = None
+        self.state = None
+        self.pending = None
+        self.counts = {}
+
+    # Function to update the tracker with the raw occupancy of the spots (class ids 1 and 2) of a new frame
+    # max_iou (optional) is the IoU with the best car of each spot, cars (optional) the number of detected cars
+    def update(self, class_ids, occupied, timestamp, max_iou=None, cars=None):
+        occupied = np.asarray(occupied, dtype=bool)
+
+        # The first frame sets the state of every spot
+        if self.state is None:
+            self.class_ids = np.asarray(class_ids).copy()
+            self.state = occupied.copy()
+            self.pending = np.zeros(len(occupied), dtype=np.int64)
+            self.counts = occupancy_counts(self.class_ids, self.state, with_cars=False)
+        else:
+            # Count the consecutive frames disagreeing with the state of each spot
+            self.pending = np.where(occupied != self.state, self.pending + 1, 0)
+
+        events = []
+        for spot in np.flatnonzero(self.pending >= self.flip_frames).tolist():
+            new_state = bool(occupied[spot])
+            self.state[spot] = new_state
+            self.pending[spot] = 0
+
+            spot_type = 'disabled parking spots' if self.class_ids[spot] == 1 else 'parking spots'
+            self.counts[f'Occupied {spot_type}'] += 1 if new_state else -1
+            self.counts[f'Empty {spot_type}'] -= 1 if new_state else -1
+
+            events.append({
+                'Spot': spot,
+                'Class': int(self.class_ids[spot]),
+                'Old state': 'Empty' if new_state else 'Occupied',
+                'New state': 'Occupied' if new_state else 'Empty',
+                'Timestamp': timestamp,
+                'IoU': float(max_iou[spot]) if max_iou is not None else None
+            })
+
+        if cars is not None:
+            self.counts['Cars'] = int(cars)
+        if self.counts['Cars'] is not None:
+            self.counts['Cars in transit or parked in non-parking spots'] = self.counts['Cars'] - self.counts['Occupied disabled parking spots'] - self.counts['Occupied parking spots']
+
+        return events
+
+# Generator processing a stream of frames (see stream_occupancy) through an OccupancyTracker,
+# yields only the events of the spots that flipped, the tracker holds the current counts
+def track_stream(source: str, layouts_folder: str, layout: str, tracker: OccupancyTracker, **kwargs):
+    for index, timestamp, class_ids, occupied, max_iou, cars, _ in stream_occupancy(source, layouts_folder, layout, **kwargs):
+        for event in tracker.update(class_ids, occupied, timestamp, max_iou, cars):
+            event['Frame'] = index
+            yield event